@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Stand-in for rsync used by the benchmark.
+
+Transfers nothing. Each run sleeps for a random time and exits with a
+random code, both drawn from environment variables set by bench/run.py:
+
+FAKE_RSYNC_TIME   min:max seconds a run takes, default 1:3
+FAKE_RSYNC_EXITS  code:weight pairs to draw the exit code from, default 0:1
+FAKE_RSYNC_DIRS   top level directories printed for --list-only, default 8
+
+With --info=progress2 it prints progress lines while it runs and --stats
+lines at the end, like rsync 3.1.
+"""
+import os
+import random
+import sys
+import time
+
+
+def draw_exit(spec):
+    pairs = [pair.split(":") for pair in spec.split(",") if pair.strip()]
+    total = sum(float(weight) for code, weight in pairs)
+    pick = random.uniform(0, total)
+    for code, weight in pairs:
+        pick -= float(weight)
+        if pick <= 0:
+            return int(code)
+    return int(pairs[-1][0])
+
+
+def main():
+    args = sys.argv[1:]
+    if "--list-only" in args:
+        for i in range(int(os.environ.get("FAKE_RSYNC_DIRS", "8"))):
+            sys.stdout.write("drwxr-xr-x          4,096 2024/01/01 00:00:00 dir{0}\n".format(i))
+        return 0
+
+    low, high = [float(n) for n in os.environ.get("FAKE_RSYNC_TIME", "1:3").split(":")]
+    duration = random.uniform(low, high)
+    code = draw_exit(os.environ.get("FAKE_RSYNC_EXITS", "0:1"))
+
+    if "--info=progress2" not in args:
+        time.sleep(duration)
+        return code
+
+    total = random.randint(1, 1000) * 1024 * 1024
+    start = time.time()
+    while True:
+        elapsed = time.time() - start
+        done = min(elapsed / duration, 1.0) if duration else 1.0
+        sys.stdout.write("\r  {0:,}  {1}%   10.00MB/s    0:00:{2:02d} (xfr#{3}, to-chk={4}/100)".format(
+            int(total * done), int(done * 100), int(max(duration - elapsed, 0)) % 60, int(done * 100), 100 - int(done * 100)))
+        sys.stdout.flush()
+        if done >= 1.0:
+            break
+        time.sleep(min(0.5, duration - elapsed))
+    sys.stdout.write("\nNumber of files: 100\nNumber of regular files transferred: 100\n"
+                     "Total file size: {0:,} bytes\nTotal transferred file size: {0:,} bytes\n"
+                     "Total bytes received: {0:,}\n".format(total))
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""Benchmark of RepoManager scheduling against a fake rsync.
+
+Generates a config of N synthetic repos whose rsync is bench/fake_rsync.py,
+runs a RepoManager on it for a while and reports:
+
+dispatch latency  seconds from a slot being freed while repos are queued to the next sync starting
+utilization       mean share of async_processes slots in use
+staleness         seconds since each repo last synced successfully, at the end of the run
+threads           max threads alive in the manager process
+cpu, memory       cpu seconds used by the manager process per second of wall time, and its max rss
+
+Runs offline. Save a run with --json and compare a later one against it with
+--baseline.
+
+    python bench/run.py --repos 200 --slots 8 --time 120 --json before.json
+    python bench/run.py --repos 200 --slots 8 --time 120 --baseline before.json
+"""
+import argparse
+import ConfigParser
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mirrors.repo import Repo, RepoManager
+
+FAKE_RSYNC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_rsync.py")
+
+
+def generate_config(args, directory):
+    """Synthetic config of args.repos repos syncing from args.hosts hosts.
+
+    :param args: parsed command line
+    :param str directory: Directory for the repo destinations and logs
+    :rtype: ConfigParser.ConfigParser
+    """
+    rng = random.Random(args.seed)
+    config = ConfigParser.ConfigParser()
+    config.add_section("GLOBAL")
+    config.set("GLOBAL", "async_processes", str(args.slots))
+    config.set("GLOBAL", "rsync_path", FAKE_RSYNC)
+    config.set("GLOBAL", "engine", args.engine)
+    config.set("GLOBAL", "policy", args.policy)
+    config.set("GLOBAL", "progress", str(args.progress))
+    config.set("GLOBAL", "host_connections", str(args.host_connections))
+    config.set("GLOBAL", "retry_base", "1s")
+    config.set("GLOBAL", "retry_max", "10s")
+    for i in range(args.repos):
+        name = "repo{0:04d}".format(i)
+        config.add_section(name)
+        config.set(name, "source", "rsync://host{0}.example.com/{1}".format(i % args.hosts, name))
+        config.set(name, "rsync_args", "-a")
+        config.set(name, "destination", os.path.join(directory, "distros", name) + "/")
+        config.set(name, "log_file", os.path.join(directory, "log", name + ".log"))
+        config.set(name, "weight", str(rng.randint(-10, 10)))
+        config.set(name, "async_sleep", args.sleep)
+        if args.shards > 1 and i % 10 == 0:
+            config.set(name, "shards", str(args.shards))
+    return config
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "max": None}
+    return {"count": len(values), "mean": sum(values) / len(values), "p50": percentile(values, 0.5),
+            "p95": percentile(values, 0.95), "max": max(values)}
+
+
+def rss():
+    """Current resident memory of this process in bytes."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def run(args):
+    directory = tempfile.mkdtemp(prefix="mirrors-bench.")
+    os.environ["FAKE_RSYNC_TIME"] = args.sync_time
+    os.environ["FAKE_RSYNC_EXITS"] = args.exits
+    config = generate_config(args, directory)
+    if args.write_config:
+        with open(args.write_config, "w") as f:
+            config.write(f)
+
+    lock = threading.Lock()
+    # unix timestamps of slots freed while repos were queued, not yet taken
+    freed = []
+    latencies = []
+    starts = [0]
+
+    manager = RepoManager(config)
+    release_slot = manager.release_slot
+    start_sync = Repo.start_sync
+
+    def timed_release(name):
+        with lock:
+            if manager.repo_queue:
+                freed.append(time.time())
+        release_slot(name)
+
+    def timed_start(repo):
+        with lock:
+            starts[0] += 1
+            if freed:
+                latencies.append(time.time() - freed.pop(0))
+        start_sync(repo)
+
+    manager.release_slot = timed_release
+    Repo.start_sync = timed_start
+
+    began = time.time()
+    cpu_before = resource.getrusage(resource.RUSAGE_SELF)
+    for section in config.sections():
+        if section != "GLOBAL":
+            manager.add_repo(section)
+            manager.schedule_startup(section)
+
+    busy = []
+    threads = []
+    memory = []
+    while time.time() - began < args.time:
+        time.sleep(args.interval)
+        busy.append(float(manager.running_syncs) / args.slots)
+        threads.append(threading.active_count())
+        memory.append(rss())
+
+    now = time.time()
+    cpu_after = resource.getrusage(resource.RUSAGE_SELF)
+    staleness = []
+    syncs = failures = 0
+    for repo in manager.gen_repo():
+        stats = manager.stats(repo.name)
+        syncs += stats["syncs"]
+        failures += stats["failures"]
+        staleness.append(now - (stats["last_success"] or began))
+
+    wall = now - began
+    cpu = (cpu_after.ru_utime + cpu_after.ru_stime) - (cpu_before.ru_utime + cpu_before.ru_stime)
+    result = {
+        "params": dict((key, value) for key, value in vars(args).items() if key not in ("json", "baseline", "write_config")),
+        "syncs": syncs,
+        "failures": failures,
+        "starts": starts[0],
+        "dispatch_latency": summarize(latencies),
+        "utilization": sum(busy) / len(busy) if busy else None,
+        "staleness": summarize(staleness),
+        "threads_max": max(threads) if threads else threading.active_count(),
+        "cpu_per_second": cpu / wall,
+        "rss_max": max(memory) if memory else rss(),
+    }
+    shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+def flatten(result, prefix=""):
+    rows = []
+    for key in sorted(result):
+        if key == "params":
+            continue
+        value = result[key]
+        if isinstance(value, dict):
+            rows.extend(flatten(value, prefix + key + "."))
+        else:
+            rows.append((prefix + key, value))
+    return rows
+
+
+def report(result, baseline=None):
+    base = dict(flatten(baseline)) if baseline else {}
+    for key, value in flatten(result):
+        line = "{0:28} {1}".format(key, "-" if value is None else "{0:.4f}".format(value) if isinstance(value, float) else value)
+        if isinstance(base.get(key), (int, float)) and isinstance(value, (int, float)) and base[key]:
+            line += "  ({0:+.1f}% vs baseline {1:.4g})".format((value - base[key]) * 100.0 / base[key], base[key])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RepoManager scheduling against a fake rsync")
+    parser.add_argument("--repos", type=int, default=100, help="Number of synthetic repos")
+    parser.add_argument("--hosts", type=int, default=10, help="Number of upstream hosts the repos are spread over")
+    parser.add_argument("--slots", type=int, default=8, help="async_processes")
+    parser.add_argument("--time", type=float, default=60, help="Seconds to run")
+    parser.add_argument("--sleep", default="10s", help="async_sleep of every repo")
+    parser.add_argument("--sync-time", default="1:3", help="min:max seconds a fake rsync takes")
+    parser.add_argument("--exits", default="0:1", help="code:weight pairs of fake rsync exit codes (ex. 0:95,23:3,10:2)")
+    parser.add_argument("--engine", default="thread", choices=["thread", "event"])
+    parser.add_argument("--policy", default="weight")
+    parser.add_argument("--progress", action="store_true", help="Parse fake rsync progress output")
+    parser.add_argument("--host-connections", type=int, default=0)
+    parser.add_argument("--shards", type=int, default=1, help="shards of every tenth repo")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated config")
+    parser.add_argument("--interval", type=float, default=0.25, help="Seconds between samples")
+    parser.add_argument("--write-config", metavar="path", help="Also write the generated config here")
+    parser.add_argument("--json", metavar="path", help="Write the results here")
+    parser.add_argument("--baseline", metavar="path", help="Compare against results written by --json")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    result = run(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    sys.stdout.flush()
+    # skip interpreter teardown, the manager's daemon threads are still running
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
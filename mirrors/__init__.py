@@ -3,14 +3,31 @@ import argparse
 import ConfigParser
 import logging
 import os
-from mirrors.repo import RepoManager, RepoConfigError, GlobalError
+import signal
+import socket
+import threading
+from mirrors.repo import RepoManager, RepoConfigError, RepoError, GlobalError
 from mirrors.cmdline import Console
+from mirrors.control import ControlServer
+
+
+def reload_config(manager):
+    """Reload the config file, logging rather than raising a failure.
+
+    :param manager: Manager to reload
+    :type manager: RepoManager
+    """
+    try:
+        manager.reload()
+    except GlobalError as e:
+        logging.error("Reload failed | {0}".format(e.message))
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", metavar="config", help="Configuration File Location", required=True)
     parser.add_argument("--log", metavar="logfile", help="Path to Log File")
+    parser.add_argument("--no-console", action="store_true", help="Run without the interactive shell")
     debug_group = parser.add_mutually_exclusive_group(required=False)
     #debug_group.add_argument('-v', '--verbose', action='store_true', help="Increase Verbosity")
     debug_group.add_argument('-D', '--debug', action='store_true', help="Debug Mode")
@@ -49,7 +66,7 @@ def main():
 
     logging.debug("Beginning Loading Repos")
     try:
-        manager = RepoManager(config)
+        manager = RepoManager(config, args.c)
     except GlobalError as e:
         logging.critical("Critical Failure While Loading GLOBAL Section | {0}".format(e.message))
         logging.critical("Program Terminating Due to Critical Error")
@@ -59,11 +76,28 @@ def main():
         try:
             if name != "GLOBAL":
                 manager.add_repo(name)
-                manager.enqueue(name)
+                manager.schedule_startup(name)
         except RepoConfigError as e:
             logging.warning("FAILED TO LOAD {0} | {1}".format(e.name, e.message))
+        except RepoError as e:
+            logging.info(e.message)
     logging.debug("Finished Loading Repos")
 
+    # reload in its own thread, the handler may interrupt one holding the manager's locks
+    signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(name="reload", target=reload_config, args=(manager,)).start())
+
+    if config.has_option("GLOBAL", "control_socket") and config.get("GLOBAL", "control_socket"):
+        try:
+            ControlServer(manager, config.get("GLOBAL", "control_socket")).start()
+        except (socket.error, OSError) as e:
+            logging.critical("Failed to open control_socket {0}: {1}".format(config.get("GLOBAL", "control_socket"), e))
+            exit(1)
+
+    if args.no_console:
+        logging.debug("Running without Command Loop")
+        while(True):
+            signal.pause()
+
     logging.debug("Starting Command Loop")
     console = Console(manager)
     console.cmdloop()
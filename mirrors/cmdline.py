@@ -1,6 +1,6 @@
 from cmd import Cmd
 import logging
-from mirrors.repo import RepoError
+from mirrors.repo import RepoError, RepoConfigError, GlobalError
 
 
 class Console(Cmd):
@@ -19,8 +19,8 @@ class Console(Cmd):
             except RepoError as e:
                 print e.message
         else:
-            for key in self.repo_manager.gen_repo():
-                self.do_status(key.name)
+            for row in self.repo_manager.snapshot():
+                print self.repo_manager.status(row["name"])
 
     def do_list(self, *args):
         """List all of the loaded repos."""
@@ -75,9 +75,46 @@ class Console(Cmd):
     def do_config(self, *args):
         """Edit configuration running settings.
 
-        TODO
+        config <repo> prints the running settings of a repo.
+        config <repo> <option> <value> changes one, a syncing repo picks it up
+        after its sync. Settings of a section which isn't loaded yet are only
+        stored, load it with add.
         """
-        pass
+        fields = args[0].split(None, 2)
+        if not fields:
+            print("Requires a repo name as an argument.")
+            return
+        name = fields[0]
+        config = self.repo_manager.config
+        if len(fields) == 1:
+            if config.has_section(name):
+                for option, value in sorted(config.items(name, raw=True)):
+                    print("{0} = {1}".format(option, value))
+            else:
+                print("No section named {0}".format(name))
+            return
+        if len(fields) == 2:
+            print("Requires a value for {0}".format(fields[1]))
+            return
+
+        option, value = fields[1], fields[2]
+        if name == "GLOBAL":
+            print("GLOBAL settings are changed through the config file and reload")
+        elif self.repo_manager.get_repo(name):
+            options = dict(config.items(name, raw=True))
+            options[option] = value
+            try:
+                if self.repo_manager.configure_repo(name, options):
+                    print("{0} {1} set to {2}".format(name, option, value))
+                else:
+                    print("{0} {1} set to {2} once its sync is done".format(name, option, value))
+            except (RepoError, RepoConfigError) as e:
+                print(e.message)
+        else:
+            if not config.has_section(name):
+                config.add_section(name)
+            config.set(name, option, value)
+            print("{0} {1} set to {2}, load it with add {0}".format(name, option, value))
 
     def do_write(self, *args):
         """Write configuration settings to file.
@@ -87,25 +124,50 @@ class Console(Cmd):
         pass
 
     def do_add(self, *args):
-        """Add repo from running config.
-
-        TODO
-        """
-        pass
+        """Add repo from running config."""
+        name = args[0]
+        if name:
+            try:
+                self.repo_manager.load_repo(name)
+                print("{0} added".format(name))
+            except (RepoError, RepoConfigError) as e:
+                print(e.message)
+        else:
+            print("Requires a repo name as an argument.")
 
     def do_del(self, *args):
         """Delete repo from running config.
 
-        TODO
+        del <repo> lets a running sync finish first, del <repo> terminate stops it.
         """
-        pass
+        fields = args[0].split()
+        if fields:
+            try:
+                if self.repo_manager.remove_repo(fields[0], "terminate" in fields[1:]):
+                    print("{0} deleted".format(fields[0]))
+                else:
+                    print("{0} deleted once its sync is done".format(fields[0]))
+            except RepoError as e:
+                print(e.message)
+        else:
+            print("Requires a repo name as an argument.")
 
     def do_reload(self, *args):
         """Reload either individual or entire config.
 
-        TODO
+        reload re-reads the config file and applies what changed, reload <repo>
+        only that section.
         """
-        pass
+        try:
+            result = self.repo_manager.reload(args[0] or None)
+        except GlobalError as e:
+            print(e.message)
+            return
+        for key in ("added", "removed", "changed", "failed"):
+            if result[key]:
+                print("{0}: {1}".format(key, ", ".join(result[key])))
+        if not any(result.values()):
+            print("No changes")
 
     def do_terminate(self, *args):
         """Send SIGTERM to rsync process."""
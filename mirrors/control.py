@@ -0,0 +1,231 @@
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import socket
+import SocketServer
+import sys
+import threading
+from mirrors.repo import RepoError, GlobalError
+
+
+def select_repos(repo_manager, patterns):
+    """Names of the repos matching glob patterns.
+
+    :param repo_manager: Manager holding the repos
+    :type repo_manager: RepoManager
+    :param patterns: glob or list of globs, None matches every repo
+    :type patterns: str or list
+    :rtype: list
+    :returns: sorted list of matching repo names
+    """
+    names = sorted(repo.name for repo in repo_manager.gen_repo())
+    if patterns is None:
+        return names
+    if isinstance(patterns, basestring):
+        patterns = [patterns]
+    return [name for name in names if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)]
+
+
+def existing_repo(repo_manager, name):
+    """Repo by name, which a reload may have removed since it was selected.
+
+    :param repo_manager: Manager holding the repos
+    :type repo_manager: RepoManager
+    :param str name: Name of repo
+    :rtype: Repo
+    :raises Repo.RepoError: if no repo exists by given name
+    """
+    repo = repo_manager.get_repo(name)
+    if not repo:
+        raise RepoError("No Repo Named {0}".format(name), name)
+    return repo
+
+
+class ControlHandler(SocketServer.StreamRequestHandler):
+    """Handles one client of the control socket.
+
+    Every line sent is a JSON request, or a JSON list of requests, and gets
+    one JSON line back. A request is an object with a command and, for
+    commands acting on repos, a repos glob or list of globs. ex.
+
+    {"command": "enqueue", "repos": "debian*"}
+
+    snapshot returns the status rows of the matching repos in one response,
+    optionally sorted by a column.
+
+    {"command": "snapshot", "sort": "last_duration", "reverse": true}
+
+    reload applies the changes made to the config file and returns the repos
+    added, removed, changed and failed.
+
+    {"command": "reload"}
+    """
+
+    # commands taking repos, mapped to the function run for each repo
+    COMMANDS = {
+        "status": lambda manager, name: manager.status(name),
+        "enqueue": lambda manager, name: manager.enqueue(name),
+        "activate": lambda manager, name: manager.activate(name),
+        "deactivate": lambda manager, name: manager.deactivate(name),
+        "terminate": lambda manager, name: existing_repo(manager, name).terminate(),
+        "kill": lambda manager, name: existing_repo(manager, name).kill(),
+    }
+
+    # commands which act on every repo when no repos are given
+    ALL_BY_DEFAULT = ("status", "list", "snapshot")
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {"ok": False, "error": "Invalid JSON: {0}".format(e)}
+            else:
+                if isinstance(request, list):
+                    response = [self.execute(item) for item in request]
+                else:
+                    response = self.execute(request)
+            self.wfile.write(json.dumps(response) + "\n")
+            self.wfile.flush()
+
+    def execute(self, request):
+        """Run a single request.
+
+        :param dict request: Decoded request
+        :rtype: dict
+        :returns: dict response, ok is False if the request failed as a whole
+        """
+        manager = self.server.repo_manager
+        if not isinstance(request, dict) or "command" not in request:
+            return {"ok": False, "error": "Request requires a command"}
+
+        command = request["command"]
+        if command not in ("list", "snapshot", "reload") and command not in self.COMMANDS:
+            return {"ok": False, "error": "Unknown command {0}".format(command)}
+
+        if command == "reload":
+            try:
+                return {"ok": True, "reload": manager.reload()}
+            except GlobalError as e:
+                return {"ok": False, "error": e.message}
+
+        patterns = request.get("repos")
+        if patterns is None and command not in self.ALL_BY_DEFAULT:
+            return {"ok": False, "error": "{0} requires repos".format(command)}
+        names = select_repos(manager, patterns)
+
+        if command == "list":
+            return {"ok": True, "repos": names}
+
+        if command == "snapshot":
+            try:
+                rows = manager.snapshot(request.get("sort", "name"), bool(request.get("reverse")))
+            except ValueError as e:
+                return {"ok": False, "error": str(e)}
+            selected = set(names)
+            return {"ok": True, "columns": manager.status_columns, "rows": [row for row in rows if row["name"] in selected]}
+
+        results = dict()
+        for name in names:
+            try:
+                results[name] = {"ok": True, "result": self.COMMANDS[command](manager, name)}
+            except RepoError as e:
+                results[name] = {"ok": False, "error": e.message}
+        logging.debug("control {0} on {1} repos".format(command, len(names)))
+        return {"ok": True, "results": results}
+
+
+class ControlServer(threading.Thread):
+    def __init__(self, repo_manager, path):
+        """Thread serving the JSON control API on a unix domain socket.
+
+        Each client is served by its own thread.
+
+        :param repo_manager: Manager the requests act on
+        :type repo_manager: RepoManager
+        :param str path: Location of the socket, replaced if it exists
+        :raises socket.error: if the socket can't be bound
+        """
+        threading.Thread.__init__(self, name="control")
+        self.daemon = True
+        self.path = path
+
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = SocketServer.ThreadingUnixStreamServer(path, ControlHandler)
+        self.server.daemon_threads = True
+        self.server.repo_manager = repo_manager
+        os.chmod(path, 0660)
+
+    def run(self):
+        logging.info("Serving control socket on {0}".format(self.path))
+        self.server.serve_forever()
+
+
+def request(path, requests):
+    """Send requests to a running daemon.
+
+    :param str path: Location of the control socket
+    :param requests: request dict or list of request dicts
+    :rtype: dict or list
+    :returns: decoded response
+    :raises socket.error: if the daemon can't be reached
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        client.sendall(json.dumps(requests) + "\n")
+        return json.loads(client.makefile().readline())
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control a running mirrors daemon")
+    parser.add_argument("-s", metavar="socket", help="Control socket location", default="./mirrors.sock")
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON response")
+    parser.add_argument("--sort", metavar="column", help="Column to sort snapshot by", default="name")
+    parser.add_argument("--reverse", action="store_true", help="Sort snapshot descending")
+    parser.add_argument("command", choices=["list", "reload", "snapshot"] + sorted(ControlHandler.COMMANDS))
+    parser.add_argument("repos", nargs="*", help="Repo names or globs, default all for list and status")
+    args = parser.parse_args()
+
+    try:
+        response = request(args.s, {"command": args.command, "repos": args.repos or None,
+                                    "sort": args.sort, "reverse": args.reverse})
+    except socket.error as e:
+        print("Error connecting to {0}: {1}".format(args.s, e))
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(response, indent=2, sort_keys=True))
+    elif not response["ok"]:
+        print(response["error"])
+    elif "repos" in response:
+        for name in response["repos"]:
+            print(name)
+    elif "reload" in response:
+        for key in ("added", "removed", "changed", "failed"):
+            if response["reload"][key]:
+                print("{0}: {1}".format(key, ", ".join(response["reload"][key])))
+    elif "rows" in response:
+        print("\t".join(response["columns"]))
+        for row in response["rows"]:
+            print("\t".join("" if row[column] is None else str(row[column]) for column in response["columns"]))
+    else:
+        for name in sorted(response["results"]):
+            result = response["results"][name]
+            if not result["ok"]:
+                print(result["error"])
+            elif result["result"] is not None:
+                print(result["result"])
+            else:
+                print("{0} {1}".format(args.command, name))
+
+    if not response["ok"] or not all(result["ok"] for result in response.get("results", {}).values()) or \
+            response.get("reload", {}).get("failed"):
+        sys.exit(1)
@@ -0,0 +1,70 @@
+import json
+import logging
+import threading
+import time
+
+
+class EventLog(object):
+    def __init__(self, path=None):
+        """Structured events of every phase of every sync.
+
+        Each event is a dict with at least time, event and repo. Phase events
+        (pre_command, probe, listing, rsync, top_level, manifest, post_command,
+        prune) are emitted when the phase ends and carry its start and
+        duration. Events are appended to a JSONL file and handed to every
+        subscribed hook.
+
+        :param str path: JSONL file events are appended to, None to only call hooks
+        :raises IOError: if the file can't be opened
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__hooks = []
+        self.__file = open(path, 'a') if path else None
+
+    def subscribe(self, hook):
+        """Call a function with every event.
+
+        Hooks run in the thread emitting the event and should return quickly.
+
+        :param hook: function taking the event dict
+        """
+        with self.__lock:
+            self.__hooks = self.__hooks + [hook]
+
+    def unsubscribe(self, hook):
+        """Stop calling a subscribed function.
+
+        :param hook: function passed to subscribe
+        """
+        with self.__lock:
+            self.__hooks = [h for h in self.__hooks if h is not hook]
+
+    def emit(self, event, name, **fields):
+        """Record an event.
+
+        :param str event: Name of the event (ex. enqueue or rsync)
+        :param str name: Name of repo
+        :param fields: values carried by the event
+        :rtype: dict
+        :returns: dict event emitted
+        """
+        record = dict(fields, time=time.time(), event=event, repo=name)
+        if self.__file:
+            line = json.dumps(record, sort_keys=True) + "\n"
+            with self.__lock:
+                self.__file.write(line)
+                self.__file.flush()
+        for hook in self.__hooks:
+            try:
+                hook(record)
+            except Exception:
+                logging.exception("Event hook {0} failed on {1}".format(hook, event))
+        return record
+
+    def close(self):
+        """Close the JSONL file."""
+        with self.__lock:
+            if self.__file:
+                self.__file.close()
+                self.__file = None
@@ -0,0 +1,125 @@
+import signal
+import threading
+
+
+class HookPool(object):
+    def __init__(self, size, on_release=None):
+        """Limit on the pre_command, post_command and other hooks running at once.
+
+        Hooks don't hold a sync slot, so slow post processing doesn't keep
+        network syncs from starting. Slots are handed out in the order they
+        were asked for.
+
+        :param int size: Max hooks running at once
+        :param on_release: function called without arguments after a slot is given back
+        """
+        self.size = size
+        self.on_release = on_release
+        self.running = 0
+        # tickets waiting for a slot, oldest first
+        self.__waiting = []
+        self.__cond = threading.Condition()
+
+    def acquire(self):
+        """Ask for a hook slot.
+
+        :rtype: HookTicket
+        :returns: HookTicket to wait on like a process, exits 0 once the slot is held
+        """
+        ticket = HookTicket(self)
+        with self.__cond:
+            self.__waiting.append(ticket)
+        return ticket
+
+    def try_acquire(self):
+        """Take a hook slot now, without waiting in line.
+
+        :rtype: HookTicket
+        :returns: HookTicket already holding a slot
+        :rtype: None
+        :returns: None if no slot is free or others are waiting for one
+        """
+        with self.__cond:
+            if self.running >= self.size or self.__waiting:
+                return None
+            self.running += 1
+            ticket = HookTicket(self)
+            ticket.returncode = 0
+            return ticket
+
+    def try_take(self, ticket, block=False):
+        """Give a waiting ticket a slot if one is free and it is next in line.
+
+        :param ticket: Ticket from acquire
+        :type ticket: HookTicket
+        :param bool block: wait until the ticket gets a slot or is cancelled
+        :rtype: bool
+        :returns: bool whether the ticket now holds a slot
+        """
+        with self.__cond:
+            while(True):
+                if ticket.returncode is not None:
+                    return ticket.returncode == 0
+                if self.running < self.size and self.__waiting and self.__waiting[0] is ticket:
+                    self.__waiting.pop(0)
+                    self.running += 1
+                    ticket.returncode = 0
+                    self.__cond.notify_all()
+                    return True
+                if not block:
+                    return False
+                self.__cond.wait()
+
+    def cancel(self, ticket, signum):
+        """Stop waiting for a slot.
+
+        :param ticket: Ticket from acquire
+        :type ticket: HookTicket
+        :param int signum: Signal which cancelled it, the ticket exits with -signum
+        """
+        with self.__cond:
+            if ticket in self.__waiting:
+                self.__waiting.remove(ticket)
+                ticket.returncode = -signum
+                self.__cond.notify_all()
+
+    def release(self):
+        """Give back a slot held by a ticket."""
+        with self.__cond:
+            self.running -= 1
+            self.__cond.notify_all()
+        if self.on_release:
+            self.on_release()
+
+    def __len__(self):
+        with self.__cond:
+            return len(self.__waiting)
+
+
+class HookTicket(object):
+    def __init__(self, pool):
+        """A place in line for a hook slot, waited on like a process.
+
+        Engines poll or wait on it like any yielded subprocess.Popen. It exits
+        0 once the slot is held, or -signum if it is signaled while waiting.
+
+        :param pool: Pool the slot is taken from
+        :type pool: HookPool
+        """
+        self.pool = pool
+        self.stdout = None
+        self.returncode = None
+
+    def poll(self):
+        self.pool.try_take(self)
+        return self.returncode
+
+    def wait(self):
+        self.pool.try_take(self, block=True)
+        return self.returncode
+
+    def send_signal(self, signum):
+        self.pool.cancel(self, signum)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
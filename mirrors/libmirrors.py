@@ -1,3 +1,10 @@
+import ConfigParser
+import random
+import time
+import zlib
+from datetime import datetime, timedelta
+
+
 def t2s(s):
     """Converts human readable time to seconds.
 
@@ -7,3 +14,246 @@ def t2s(s):
     """
     seconds_per_unit = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
     return int(s[:-1]) * seconds_per_unit[s[-1]]
+
+
+def parse_hours(s):
+    """Converts an hourly_sync string into a sorted list of hours.
+
+    :param str s: Comma separated hours of the day (ex. 0,6.5,12,18.5)
+    :rtype: list
+    :returns: list of float hours between 0 and 24
+    :raises ValueError: if an hour is not a number or out of range
+    """
+    hours = []
+    for hour in s.split(','):
+        hour = float(hour)
+        if not 0 <= hour < 24:
+            raise ValueError("{0} is not between 0 and 24".format(hour))
+        hours.append(hour)
+    if not hours:
+        raise ValueError("No hours given")
+    return sorted(set(hours))
+
+
+def stable_offset(name, seconds):
+    """Deterministic offset for a name, stable across restarts.
+
+    :param str name: Name to derive the offset from
+    :param int seconds: Size of the window
+    :rtype: int
+    :returns: int between 0 and seconds - 1, or 0 if seconds is 0
+    """
+    if seconds <= 0:
+        return 0
+    return (zlib.crc32(name) & 0xffffffff) % seconds
+
+
+def next_hourly(hours, now=None, offset=0):
+    """Next wall clock time on an hourly_sync schedule.
+
+    :param list hours: Sorted float hours of the day, from parse_hours
+    :param float now: unix timestamp to start from, default is the current time
+    :param int offset: seconds added to every scheduled hour
+    :rtype: float
+    :returns: unix timestamp of the first scheduled time after now
+    """
+    if now is None:
+        now = time.time()
+    midnight = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    for day in range(-1, 2):
+        start = midnight + timedelta(days=day)
+        for hour in hours:
+            fire = time.mktime((start + timedelta(hours=hour)).timetuple()) + offset
+            if fire > now:
+                return fire
+
+
+def b2h(n):
+    """Converts a byte count to human readable size.
+
+    :param int n: Number of bytes
+    :rtype: str
+    :returns: str size with a binary unit (ex. 1.5G)
+    """
+    for unit in ["B", "K", "M", "G", "T"]:
+        if abs(n) < 1024 or unit == "T":
+            break
+        n /= 1024.0
+    return "{0:.1f}{1}".format(n, unit) if unit != "B" else "{0}B".format(int(n))
+
+
+def h2b(s):
+    """Converts a human readable size to bytes.
+
+    :param str s: Size with an optional binary unit (ex. 512, 100M or 2G)
+    :rtype: int
+    :returns: int size in bytes
+    :raises ValueError: if the size is malformed
+    """
+    units = {"B": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    s = s.strip().upper()
+    if s and s[-1] in units:
+        return int(float(s[:-1]) * units[s[-1]])
+    return int(s)
+
+
+def source_host(source):
+    """Host an rsync source is pulled from.
+
+    :param str source: rsync source (ex. rsync://host/path, host::module or user@host:path)
+    :rtype: str
+    :returns: str lowercase host name
+    :rtype: None
+    :returns: None if the source is a local path
+    """
+    if "://" in source:
+        host = source.split("://", 1)[1].split("/", 1)[0]
+        host = host.rsplit("@", 1)[-1]
+        if host.startswith("["):
+            return host[1:host.find("]")].lower()
+        return host.split(":", 1)[0].lower()
+    if ":" in source.split("/", 1)[0]:
+        host = source.rsplit("@", 1)[-1] if "@" in source.split(":", 1)[0] else source
+        if host.startswith("["):
+            return host[1:host.find("]")].lower()
+        return host.split(":", 1)[0].lower() or None
+    return None
+
+
+def probe_url(source, probe):
+    """Location of a repo's probe file upstream.
+
+    :param str source: rsync source of the repo
+    :param str probe: path of the probe file relative to source, or a full rsync source
+    :rtype: str
+    :returns: str rsync source of the probe file
+    """
+    if "://" in probe or "::" in probe:
+        return probe
+    return "{0}/{1}".format(source.rstrip("/"), probe.lstrip("/"))
+
+
+def parse_limits(s):
+    """Converts a list of host limits to a dict.
+
+    :param str s: Comma separated host:limit pairs (ex. mirrors.rit.edu:4, ftp.ibiblio.org:1)
+    :rtype: dict
+    :returns: dict of lowercase host to int limit
+    :raises ValueError: if a pair is malformed
+    """
+    limits = dict()
+    for pair in s.split(","):
+        if not pair.strip():
+            continue
+        host, limit = pair.rsplit(":", 1)
+        limits[host.strip().lower()] = int(limit)
+    return limits
+
+
+def parse_bool(s):
+    """Converts a config boolean the way ConfigParser.getboolean does.
+
+    :param str s: 1, yes, true or on, or 0, no, false or off, in any case
+    :rtype: bool
+    :raises ValueError: if s isn't a boolean
+    """
+    states = {"1": True, "yes": True, "true": True, "on": True, "0": False, "no": False, "false": False, "off": False}
+    if s.lower() not in states:
+        raise ValueError("Not a boolean: {0}".format(s))
+    return states[s.lower()]
+
+
+def parse_int(s, low, high):
+    """Converts a string to an int inside a range.
+
+    :param str s: integer string
+    :param int low: lowest allowed value
+    :param int high: highest allowed value
+    :rtype: int
+    :raises ValueError: if s isn't an integer or is out of range
+    """
+    n = int(s)
+    if not low <= n <= high:
+        raise ValueError("{0} is not between {1} and {2}".format(n, low, high))
+    return n
+
+
+def read_sections(path):
+    """Reads a config file into plain dicts.
+
+    :param str path: Location of the ini file
+    :rtype: dict
+    :returns: dict of section name to dict of raw option values
+    :raises IOError: if the file can't be read
+    :raises ConfigParser.Error: if the file can't be parsed
+    """
+    config = ConfigParser.ConfigParser()
+    with open(path) as f:
+        config.readfp(f, path)
+    return dict((section, dict(config.items(section, raw=True))) for section in config.sections())
+
+
+def replace_section(config, name, options):
+    """Replaces every option of a config section.
+
+    :param config: config to change
+    :type config: ConfigParser.ConfigParser
+    :param str name: Name of the section, created if missing
+    :param dict options: raw option values of the new section
+    """
+    if config.has_section(name):
+        config.remove_section(name)
+    config.add_section(name)
+    for option, value in options.items():
+        config.set(name, option, value)
+
+
+# rsync exit codes worth retrying soon: protocol, socket and timeout errors or a signal
+TRANSIENT_EXITS = frozenset([5, 10, 12, 14, 20, 21, 30, 35, 255])
+# rsync exit codes of a transfer which finished with some files skipped
+PARTIAL_EXITS = frozenset([23, 24])
+
+
+def classify_exit(code):
+    """Classifies an rsync exit code.
+
+    A negative code, rsync killed by a signal, is transient.
+
+    :param int code: rsync exit code, None if rsync never ran
+    :rtype: str
+    :returns: success, partial, transient or fatal
+    """
+    if code == 0:
+        return "success"
+    elif code in PARTIAL_EXITS:
+        return "partial"
+    elif code in TRANSIENT_EXITS or (code is not None and code < 0):
+        return "transient"
+    return "fatal"
+
+
+def worst_exit(codes):
+    """Most severe of several rsync exit codes.
+
+    :param list codes: rsync exit codes
+    :rtype: int
+    :returns: int the fatal, transient or partial code if any, otherwise 0
+    """
+    severity = {"success": 0, "partial": 1, "transient": 2, "fatal": 3}
+    return max(codes, key=lambda code: severity[classify_exit(code)])
+
+
+def backoff(attempt, base, cap):
+    """Delay before retrying a failed attempt, with jitter.
+
+    The delay doubles each attempt up to cap, then a random delay between
+    half of it and all of it is picked.
+
+    :param int attempt: Number of consecutive failures, starting at 1
+    :param int base: seconds to wait after the first failure
+    :param int cap: max seconds to wait
+    :rtype: float
+    :returns: float seconds to wait
+    """
+    delay = min(cap, base * 2 ** min(attempt - 1, 32))
+    return random.uniform(delay / 2.0, delay)
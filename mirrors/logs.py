@@ -0,0 +1,204 @@
+import Queue
+import logging
+import os
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+# command compressing a rotated segment in place and the suffix it adds
+COMPRESSORS = {
+    "gzip": (["gzip", "-f"], ".gz"),
+    "zstd": (["zstd", "-q", "-f", "--rm"], ".zst"),
+}
+
+# suffix of a rotated segment, the time it was rotated
+SEGMENT_FORMAT = "%Y%m%d-%H%M%S"
+
+
+class Compressor(threading.Thread):
+    def __init__(self):
+        """Thread compressing rotated log segments in the background.
+
+        Segments are compressed one at a time so rotating many logs at once
+        doesn't compete with running syncs for cpu and disk.
+        """
+        threading.Thread.__init__(self, name="compressor")
+        self.daemon = True
+        self.__queue = Queue.Queue()
+
+    def compress(self, path, method):
+        """Queue a file to be compressed.
+
+        :param str path: Location of the file, replaced by the compressed file
+        :param str method: key of COMPRESSORS
+        """
+        self.__queue.put((path, method))
+
+    def run(self):
+        while(True):
+            path, method = self.__queue.get()
+            command, suffix = COMPRESSORS[method]
+            try:
+                code = subprocess.call(command + [path], close_fds=True)
+            except OSError as e:
+                logging.error("Failed to run {0} on {1}: {2}".format(command[0], path, e))
+                continue
+            if code:
+                logging.error("{0} of {1} exited with {2}".format(command[0], path, code))
+            else:
+                logging.debug("Compressed {0} to {0}{1}".format(path, suffix))
+
+
+class LogRotator(object):
+    def __init__(self, path, max_size=0, max_age=0, keep=0, compress=None, compressor=None):
+        """Rotates a repo log between syncs.
+
+        The log is renamed to path.YYYYmmdd-HHMMSS once it is larger than
+        max_size or its oldest output is older than max_age, then optionally
+        compressed in the background. Rotated segments beyond keep are
+        deleted, oldest first.
+
+        :param str path: Location of the log
+        :param int max_size: bytes the log may grow to, 0 for no limit
+        :param int max_age: seconds a log is written to, 0 for no limit
+        :param int keep: rotated segments kept, 0 keeps every segment
+        :param str compress: key of COMPRESSORS, None to leave segments uncompressed
+        :param compressor: Thread compressing the rotated segments
+        :type compressor: Compressor
+        """
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.keep = keep
+        self.compress = compress
+        self.compressor = compressor
+
+        # unix timestamp the current log was started, from its newest segment
+        segments = self.segments()
+        if segments:
+            self.started = self.__rotated_at(segments[-1])
+        else:
+            self.started = time.time()
+
+    def __rotated_at(self, segment):
+        """unix timestamp a segment was rotated, from its name."""
+        stamp = segment[len(self.path) + 1:].split(".", 1)[0]
+        try:
+            return time.mktime(datetime.strptime(stamp, SEGMENT_FORMAT).timetuple())
+        except ValueError:
+            return time.time()
+
+    def segments(self):
+        """Rotated segments of the log, oldest first.
+
+        A segment being compressed is listed once.
+
+        :rtype: list
+        :returns: list of segment paths without compression suffix
+        """
+        directory, base = os.path.split(self.path)
+        segments = set()
+        for entry in os.listdir(directory or "."):
+            if not entry.startswith(base + "."):
+                continue
+            stamp = entry[len(base) + 1:].split(".", 1)[0]
+            try:
+                datetime.strptime(stamp, SEGMENT_FORMAT)
+            except ValueError:
+                continue
+            segments.add("{0}.{1}".format(self.path, stamp))
+        return sorted(segments)
+
+    def due(self, now=None):
+        """Bool of whether the log should be rotated.
+
+        :param float now: unix timestamp, default is the current time
+        :rtype: bool
+        """
+        if now is None:
+            now = time.time()
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return False
+        if not size:
+            return False
+        if self.max_size and size >= self.max_size:
+            return True
+        return bool(self.max_age and now - self.started >= self.max_age)
+
+    def rotate(self, now=None):
+        """Rotate the log if it is due.
+
+        :param float now: unix timestamp, default is the current time
+        :rtype: str
+        :returns: str path of the new segment
+        :rtype: None
+        :returns: None if the log wasn't rotated
+        """
+        if now is None:
+            now = time.time()
+        if not self.due(now):
+            return None
+
+        segment = "{0}.{1}".format(self.path, datetime.fromtimestamp(now).strftime(SEGMENT_FORMAT))
+        if segment in self.segments():
+            return None
+        try:
+            os.rename(self.path, segment)
+            open(self.path, 'a').close()
+        except (IOError, OSError) as e:
+            logging.error("Failed to rotate {0}: {1}".format(self.path, e))
+            return None
+        logging.info("Rotated {0} to {1}".format(self.path, segment))
+        self.started = now
+
+        if self.compress and self.compressor:
+            self.compressor.compress(segment, self.compress)
+        self.prune()
+        return segment
+
+    def prune(self):
+        """Delete the oldest segments beyond keep."""
+        if not self.keep:
+            return
+        for segment in self.segments()[:-self.keep]:
+            for path in [segment] + [segment + suffix for command, suffix in COMPRESSORS.values()]:
+                if not os.path.exists(path):
+                    continue
+                try:
+                    os.unlink(path)
+                    logging.debug("Deleted {0}".format(path))
+                except OSError as e:
+                    logging.error("Failed to delete {0}: {1}".format(path, e))
+
+
+def write_index(path, name, start, finish, outcome, exit_code, transferred, log_file):
+    """Append a one line summary of a sync to an index file.
+
+    Lines are tab separated name, start, finish, duration in seconds,
+    outcome, exit code, bytes transferred and log file, with - for unknown
+    values, so the last runs can be found without reading the full log.
+
+    :param str path: Location of the index file
+    :param str name: Name of repo
+    :param datetime start: Time the sync started
+    :param datetime finish: Time the sync finished
+    :param str outcome: result of the sync (ex. success or failed)
+    :param int exit_code: rsync exit code, None if rsync never ran
+    :param int transferred: bytes transferred, None if unknown
+    :param str log_file: log the sync's output was written to
+    """
+    fields = [name, start.strftime("%Y-%m-%dT%H:%M:%S"), finish.strftime("%Y-%m-%dT%H:%M:%S"),
+              "{0:.1f}".format((finish - start).total_seconds()), outcome, exit_code, transferred, log_file]
+    line = "\t".join("-" if field is None else str(field) for field in fields) + "\n"
+    try:
+        # a single write of an appended line, so repos may share an index
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logging.error("Failed to write {0}: {1}".format(path, e))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+import argparse
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import os
+import stat
+import sys
+import time
+
+# bytes of a file mapped and hashed at a time
+CHUNK = 64 * 1024 * 1024
+
+
+def hash_file(path):
+    """sha256 of a file, read through mmap.
+
+    :param str path: Location of the file
+    :rtype: str
+    :returns: str hex digest
+    :raises IOError: if the file can't be read
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset < size:
+            length = min(CHUNK, size - offset)
+            view = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ, offset=offset)
+            try:
+                digest.update(view)
+            finally:
+                view.close()
+            offset += length
+    return digest.hexdigest()
+
+
+def _hash_entry(entry):
+    """Pool worker, hash a (relative path, full path) pair."""
+    relative, path = entry
+    try:
+        return relative, hash_file(path)
+    except (IOError, OSError, ValueError):
+        # vanished or unreadable, left out of the manifest
+        return relative, None
+
+
+def load(path):
+    """Read a manifest.
+
+    Lines are tab separated sha256, size, mtime and path relative to the
+    synced tree.
+
+    :param str path: Location of the manifest
+    :rtype: dict
+    :returns: dict of relative path to (size, mtime, sha256), empty if there is no manifest
+    """
+    entries = dict()
+    if not os.path.exists(path):
+        return entries
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t", 3)
+            if len(fields) == 4:
+                entries[fields[3]] = (int(fields[1]), fields[2], fields[0])
+    return entries
+
+
+def write(path, entries):
+    """Write a manifest, replacing the old one atomically.
+
+    :param str path: Location of the manifest
+    :param dict entries: relative path to (size, mtime, sha256)
+    """
+    tmp = "{0}.tmp".format(path)
+    with open(tmp, 'w') as f:
+        for relative in sorted(entries):
+            size, mtime, sha256 = entries[relative]
+            f.write("{0}\t{1}\t{2}\t{3}\n".format(sha256, size, mtime, relative))
+    os.rename(tmp, path)
+
+
+def build(root, previous, processes=2, exclude=()):
+    """Manifest of a tree, reusing the hashes of unchanged files.
+
+    A file whose size and mtime match the previous manifest keeps its hash,
+    the same quick check rsync uses to decide what to transfer, so only files
+    the sync changed are read. Those are hashed by a pool of processes.
+
+    :param str root: Directory to index
+    :param dict previous: manifest from load()
+    :param int processes: Number of hashing processes
+    :param exclude: absolute paths left out of the manifest
+    :rtype: tuple
+    :returns: tuple of the new manifest dict and the number of files hashed
+    """
+    entries = dict()
+    changed = []
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in files:
+            path = os.path.join(directory, name)
+            relative = os.path.relpath(path, root)
+            if path in exclude or "\n" in relative:
+                continue
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            mtime = "{0:.6f}".format(st.st_mtime)
+            old = previous.get(relative)
+            if old and old[0] == st.st_size and old[1] == mtime:
+                entries[relative] = old
+            else:
+                entries[relative] = (st.st_size, mtime, None)
+                changed.append((relative, path))
+
+    if changed:
+        pool = multiprocessing.Pool(processes)
+        try:
+            for relative, sha256 in pool.imap_unordered(_hash_entry, changed, chunksize=16):
+                if sha256 is None:
+                    del entries[relative]
+                else:
+                    size, mtime, _ = entries[relative]
+                    entries[relative] = (size, mtime, sha256)
+        finally:
+            pool.close()
+            pool.join()
+    return entries, len(changed)
+
+
+def main():
+    """Update the manifest of a synced tree, run by a sync after rsync."""
+    parser = argparse.ArgumentParser(description="Update the sha256 manifest of a tree")
+    parser.add_argument("root", help="Directory to index")
+    parser.add_argument("manifest", help="Manifest file, updated in place")
+    parser.add_argument("-p", metavar="processes", type=int, help="Hashing processes", default=2)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    start = time.time()
+    manifest = os.path.abspath(args.manifest)
+    entries, hashed = build(os.path.abspath(args.root), load(manifest), args.p, exclude=(manifest, manifest + ".tmp"))
+    write(manifest, entries)
+    logging.info("Manifest {0}: {1} files, {2} hashed in {3:.1f}s".format(manifest, len(entries), hashed, time.time() - start))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
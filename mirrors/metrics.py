@@ -0,0 +1,112 @@
+import BaseHTTPServer
+import logging
+import threading
+import time
+
+
+def escape(value):
+    """Escape a prometheus label value.
+
+    :param str value: Label value
+    :rtype: str
+    :returns: str with backslashes, quotes and newlines escaped
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(repo_manager):
+    """Metrics of a RepoManager in the prometheus text format.
+
+    :param repo_manager: Manager to export
+    :type repo_manager: RepoManager
+    :rtype: str
+    :returns: str text exposition
+    """
+    now = time.time()
+    lines = []
+
+    def metric(name, kind, help, samples):
+        lines.append("# HELP {0} {1}".format(name, help))
+        lines.append("# TYPE {0} {1}".format(name, kind))
+        for labels, value in samples:
+            if value is None:
+                continue
+            if labels:
+                lines.append('{0}{{repo="{1}"}} {2}'.format(name, escape(labels), value))
+            else:
+                lines.append("{0} {1}".format(name, value))
+
+    repos = sorted(repo_manager.gen_repo(), key=lambda repo: repo.name)
+    stats = dict((repo.name, repo_manager.stats(repo.name)) for repo in repos)
+
+    metric("mirrors_queue_depth", "gauge", "Repos waiting in the sync queue.",
+           [(None, len(repo_manager.repo_queue))])
+    metric("mirrors_running_syncs", "gauge", "Syncs holding a slot.",
+           [(None, repo_manager.running_syncs)])
+    metric("mirrors_async_processes", "gauge", "Max syncs running at once.",
+           [(None, repo_manager.config.getint("GLOBAL", "async_processes"))])
+    metric("mirrors_scheduled_repos", "gauge", "Repos sleeping until their next sync.",
+           [(None, len(repo_manager.scheduler))])
+
+    metric("mirrors_repo_syncing", "gauge", "1 if the repo is syncing.",
+           [(repo.name, int(repo.is_alive())) for repo in repos])
+    metric("mirrors_repo_deactive", "gauge", "1 if the repo is deactivated.",
+           [(repo.name, int(repo.deactive)) for repo in repos])
+    metric("mirrors_repo_queued_seconds", "gauge", "Seconds the repo has been waiting in the queue.",
+           [(repo.name, now - repo_manager.queued_since.get(repo.name, now)) for repo in repos])
+    metric("mirrors_repo_last_queue_wait_seconds", "gauge", "Seconds the last sync waited in the queue.",
+           [(name, stats[name]["last_queue_wait"]) for name in sorted(stats)])
+    metric("mirrors_repo_last_duration_seconds", "gauge", "Duration of the last sync.",
+           [(name, stats[name]["last_duration"]) for name in sorted(stats)])
+    metric("mirrors_repo_last_success_timestamp_seconds", "gauge", "Unix time the last successful sync finished.",
+           [(name, stats[name]["last_success"]) for name in sorted(stats)])
+    metric("mirrors_repo_syncs_total", "counter", "Finished syncs.",
+           [(name, stats[name]["syncs"]) for name in sorted(stats)])
+    metric("mirrors_repo_failures_total", "counter", "Failed syncs.",
+           [(name, stats[name]["failures"]) for name in sorted(stats)])
+    metric("mirrors_repo_skips_total", "counter", "Syncs skipped since the probe file was unchanged.",
+           [(name, stats[name]["skips"]) for name in sorted(stats)])
+    metric("mirrors_repo_consecutive_failures", "gauge", "Failed syncs in a row.",
+           [(repo.name, repo_manager.failures.get(repo.name, 0)) for repo in repos])
+    metric("mirrors_repo_bytes_transferred_total", "counter", "Bytes transferred by finished syncs, needs progress enabled.",
+           [(name, stats[name]["bytes"]) for name in sorted(stats)])
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the metrics of the server's RepoManager on /metrics."""
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render(self.server.repo_manager)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("metrics {0} {1}".format(self.client_address[0], format % args))
+
+
+class MetricsServer(threading.Thread):
+    def __init__(self, repo_manager, address, port):
+        """Thread serving prometheus metrics over http.
+
+        :param repo_manager: Manager to export
+        :type repo_manager: RepoManager
+        :param str address: Address to listen on
+        :param int port: Port to listen on
+        :raises socket.error: if the port can't be bound
+        """
+        threading.Thread.__init__(self, name="metrics")
+        self.daemon = True
+        self.httpd = BaseHTTPServer.HTTPServer((address, port), MetricsHandler)
+        self.httpd.repo_manager = repo_manager
+
+    def run(self):
+        logging.info("Serving metrics on {0}:{1}".format(*self.httpd.server_address))
+        self.httpd.serve_forever()
@@ -0,0 +1,58 @@
+import time
+
+
+class WeightPolicy(object):
+    def __init__(self, repo_manager):
+        """Order queued repos by their weight alone.
+
+        :param repo_manager: Manager the policy orders the queue of
+        :type repo_manager: RepoManager
+        """
+        self.repo_manager = repo_manager
+
+    def key(self, repo):
+        """Sort key of a repo being queued, lower keys are dispatched first.
+
+        :param repo: Repo being queued
+        :type repo: Repo
+        :rtype: tuple
+        :returns: tuple sort key
+        """
+        return (repo.config.getint(repo.name, "weight"),)
+
+
+class ShortestJobPolicy(WeightPolicy):
+    """Order queued repos by their expected sync duration, then weight.
+
+    Repos without history are expected to take no time, so they run early
+    and get measured. A repo ages by the time it has been queued, so the key
+    is the time it was queued plus its expected duration. Once queued for its
+    expected duration, no repo queued later goes ahead of it, however short.
+    """
+
+    def key(self, repo):
+        expected = self.repo_manager.expected_duration(repo.name) or 0
+        return (time.time() + expected, repo.config.getint(repo.name, "weight"))
+
+
+class DeadlinePolicy(WeightPolicy):
+    """Order queued repos by the latest time they can start and still be fresh.
+
+    A repo is due to finish one sync interval after it is queued, so the
+    latest start is that deadline minus its expected sync duration. Repos
+    with short intervals or long syncs go first.
+    """
+
+    def key(self, repo):
+        now = time.time()
+        interval = repo.next_sync_time(now) - now
+        expected = self.repo_manager.expected_duration(repo.name) or 0
+        return (now + interval - expected, repo.config.getint(repo.name, "weight"))
+
+
+# policy names accepted by the GLOBAL policy option
+POLICIES = {
+    "weight": WeightPolicy,
+    "sjf": ShortestJobPolicy,
+    "deadline": DeadlinePolicy,
+}
@@ -0,0 +1,66 @@
+import ctypes
+import errno
+import os
+import platform
+import sys
+
+# ionice scheduling classes, as in linux/ioprio.h
+IOPRIO_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+
+# number of the ioprio_set syscall by machine, glibc has no wrapper for it
+SYS_IOPRIO_SET = {"x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30, "armv7l": 314,
+                  "armv6l": 314, "ppc64": 273, "ppc64le": 273, "s390x": 282, "riscv64": 30}
+
+# loaded in the daemon, before any fork, so children only make the call
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+def ioprio_supported():
+    """Bool of whether ioprio_set can be called on this system.
+
+    :rtype: bool
+    """
+    return sys.platform.startswith("linux") and platform.machine() in SYS_IOPRIO_SET
+
+
+def ioprio_set(io_class, level, pid=0):
+    """Set the I/O scheduling class and priority of a process, like ionice.
+
+    :param str io_class: realtime, best-effort or idle
+    :param int level: priority inside the class, 0 (highest) to 7, ignored by idle
+    :param int pid: Process to change, 0 for the calling process
+    :raises OSError: if the call fails or isn't supported
+    """
+    if not ioprio_supported():
+        raise OSError(errno.ENOSYS, "ioprio_set is not supported on {0} {1}".format(sys.platform, platform.machine()))
+    ioprio = IOPRIO_CLASSES[io_class] << IOPRIO_CLASS_SHIFT | (0 if io_class == "idle" else level)
+    if _libc.syscall(SYS_IOPRIO_SET[platform.machine()], IOPRIO_WHO_PROCESS, pid, ioprio) == -1:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+
+
+class Priority(object):
+    def __init__(self, nice=0, io_class=None, io_level=4):
+        """CPU and I/O priority of the processes of a sync.
+
+        Passed as preexec_fn to subprocess.Popen, it runs in the child between
+        fork and exec so only that child is changed, never the daemon.
+
+        :param int nice: increment added to the niceness of the daemon
+        :param str io_class: realtime, best-effort or idle, None to keep the daemon's
+        :param int io_level: priority inside io_class, 0 (highest) to 7
+        """
+        self.nice = nice
+        self.io_class = io_class
+        self.io_level = io_level
+
+    def __call__(self):
+        if self.nice:
+            os.nice(self.nice)
+        if self.io_class:
+            ioprio_set(self.io_class, self.io_level)
+
+    def __repr__(self):
+        return "Priority(nice={0}, io_class={1}, io_level={2})".format(self.nice, self.io_class, self.io_level)
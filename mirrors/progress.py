@@ -0,0 +1,116 @@
+import re
+import time
+
+# rsync --info=progress2 line (ex. "  1,234,567  45%   10.52MB/s    0:01:23 (xfr#12, to-chk=100/2000)")
+PROGRESS_RE = re.compile(r'^\s*([\d,]+)\s+(\d+)%\s+([\d.,]+)([kKMGT]?B)/s\s+(\d+):(\d\d):(\d\d)'
+                         r'(?:\s+\(xfr#(\d+), (?:ir|to)-chk=(\d+)/(\d+)\))?')
+
+# rsync --stats lines and the attribute each one sets
+STATS_RE = [
+    (re.compile(r'^Number of files: ([\d,.]+[KMGT]?)'), 'files_total'),
+    (re.compile(r'^Number of regular files transferred: ([\d,.]+[KMGT]?)'), 'files_transferred'),
+    (re.compile(r'^Total file size: ([\d,.]+[KMGT]?)'), 'total_size'),
+    (re.compile(r'^Total transferred file size: ([\d,.]+[KMGT]?)'), 'bytes_transferred'),
+    (re.compile(r'^Total bytes received: ([\d,.]+[KMGT]?)'), 'bytes_received'),
+]
+
+UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(s):
+    """Converts an rsync size or count to an int.
+
+    :param str s: rsync number, with commas and optional unit (ex. 1,234 or 1.5G)
+    :rtype: int
+    :returns: int value in bytes or units
+    """
+    s = s.replace(',', '')
+    unit = ''
+    if s[-1].upper() in UNITS:
+        unit = s[-1].upper()
+        s = s[:-1]
+    return int(float(s) * UNITS[unit])
+
+
+class RsyncProgress(object):
+    def __init__(self):
+        """Streaming parser of rsync --info=progress2 --stats output.
+
+        Output is fed in arbitrary chunks as it is read from the pipe.
+        Progress lines are separated by carriage returns and stats lines by
+        newlines, partial lines are kept until the rest arrives.
+        """
+        # bytes of file data transferred so far
+        self.bytes_transferred = 0
+        # bytes received over the wire, known once the stats are printed
+        self.bytes_received = None
+        # total size of the source tree, known once the stats are printed
+        self.total_size = None
+        self.percent = 0
+        # transfer rate in bytes per second
+        self.rate = None
+        # estimated seconds until the transfer is done
+        self.eta = None
+        self.files_transferred = 0
+        self.files_checked = 0
+        self.files_total = None
+
+        # unix timestamp of the last parsed line, None if nothing parsed yet
+        self.last_update = None
+
+        self.__buffer = ''
+
+    def feed(self, data):
+        """Parse a chunk of rsync output.
+
+        :param str data: raw output read from rsync
+        """
+        lines = re.split(r'[\r\n]', self.__buffer + data)
+        self.__buffer = lines.pop()
+        for line in lines:
+            self.parse_line(line)
+
+    def parse_line(self, line):
+        """Parse a single line of rsync output, ignoring unknown lines.
+
+        :param str line: one line of output without line endings
+        """
+        match = PROGRESS_RE.match(line)
+        if match:
+            self.bytes_transferred = parse_size(match.group(1))
+            self.percent = int(match.group(2))
+            self.rate = int(float(match.group(3).replace(',', '')) * UNITS[match.group(4)[:-1].upper()])
+            self.eta = int(match.group(5)) * 3600 + int(match.group(6)) * 60 + int(match.group(7))
+            if match.group(8):
+                self.files_transferred = int(match.group(8))
+                self.files_total = int(match.group(10))
+                self.files_checked = self.files_total - int(match.group(9))
+            self.last_update = time.time()
+            return
+
+        for regex, attr in STATS_RE:
+            match = regex.match(line)
+            if match:
+                setattr(self, attr, parse_size(match.group(1)))
+                if attr == 'files_total':
+                    self.files_checked = self.files_total
+                self.last_update = time.time()
+                return
+
+    def summary(self):
+        """Current transfer metrics.
+
+        :rtype: dict
+        :returns: dict of the parsed metrics
+        """
+        return {
+            "bytes_transferred": self.bytes_transferred,
+            "bytes_received": self.bytes_received,
+            "total_size": self.total_size,
+            "percent": self.percent,
+            "rate": self.rate,
+            "eta": self.eta,
+            "files_transferred": self.files_transferred,
+            "files_checked": self.files_checked,
+            "files_total": self.files_total,
+        }
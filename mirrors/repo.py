@@ -1,11 +1,33 @@
-import Queue
+import ConfigParser
+import hashlib
+import heapq
+import itertools
 import logging
 import threading
-import time
 import subprocess
+import time
 import os
+import random
+import signal
+import socket
+import sqlite3
+import sys
+import tempfile
 from datetime import datetime, timedelta
-from mirrors.libmirrors import t2s
+from mirrors.libmirrors import t2s, b2h, h2b, parse_hours, next_hourly, stable_offset, source_host, probe_url, parse_limits, classify_exit, worst_exit, backoff, parse_bool, parse_int, read_sections, replace_section
+from mirrors.scheduler import Scheduler
+from mirrors.supervisor import Supervisor
+from mirrors.progress import RsyncProgress
+from mirrors.state import StateStore
+from mirrors.policy import POLICIES
+from mirrors.watchdog import Watchdog
+from mirrors.metrics import MetricsServer
+from mirrors.events import EventLog
+from mirrors.hooks import HookPool
+from mirrors.priority import IOPRIO_CLASSES, Priority, ioprio_supported
+from mirrors.logs import COMPRESSORS, Compressor, LogRotator, write_index
+from mirrors.shards import parse_listing, split_shards, ProcessGroup
+from mirrors.snapshot import snapshot_dir, staging_path, current_snapshot, publish, expired
 
 
 class Singleton(type):
@@ -44,6 +66,25 @@ class Repo(object):
         # Contains rsync_thread
         self.__sync = None
 
+        # Sorted hours of the day for hourly_sync repos, None for async_sleep repos
+        self.hourly = None
+
+        # HookTicket holding a hook slot for pre_command, from dispatch until the sync starts
+        self.pre_ticket = None
+
+        self.__configure()
+        self.deactive = self.config.getboolean(self.name, 'deactive')
+
+        if(self.deactive):
+            logging.info("{0} loaded successfully, but disabled".format(self.name))
+        else:
+            logging.info("{0} loaded successfully".format(self.name))
+
+    def __configure(self):
+        """Validate the config section of the repo and fill in its defaults.
+
+        :raises Repo.RepoConfigError: if the section is invalid
+        """
         # Config Validation Section
         if not self.config.has_option(self.name, 'source'):
             raise RepoConfigError("No Source Defined".format(self.name), self.name)
@@ -60,16 +101,34 @@ class Repo(object):
 
         if not self.config.has_option(self.name, 'weight'):
             self.config.set(self.name, 'weight', '0')
+        try:
+            if not -10 <= self.config.getint(self.name, 'weight') <= 10:
+                raise ValueError
+        except ValueError:
+            raise RepoConfigError("Invalid weight {0}, must be between -10 and 10".format(self.config.get(self.name, 'weight')), self.name)
 
-        if self.config.has_option(self.name, 'deactive'):
-            self.deactive = self.config.getboolean(self.name, 'deactive')
-        else:
+        if not self.config.has_option(self.name, 'deactive'):
             self.config.set(self.name, 'deactive', 'False')
+        try:
+            self.config.getboolean(self.name, 'deactive')
+        except ValueError:
+            raise RepoConfigError("Invalid deactive {0}".format(self.config.get(self.name, 'deactive')), self.name)
 
         if self.config.has_option(self.name, 'async_sleep') and self.config.has_option(self.name, 'hourly_sync'):
             raise RepoConfigError("Both async_sleep and hourly_sync cannot be defined".format(self.name), self.name)
         elif not self.config.has_option(self.name, 'async_sleep') and not self.config.has_option(self.name, 'hourly_sync'):
             raise RepoConfigError("Either async_sleep or hourly_sync must be defined".format(self.name), self.name)
+        elif self.config.has_option(self.name, 'async_sleep'):
+            hourly = None
+            try:
+                t2s(self.config.get(self.name, 'async_sleep'))
+            except (ValueError, KeyError, IndexError):
+                raise RepoConfigError("Invalid async_sleep {0}".format(self.config.get(self.name, 'async_sleep')), self.name)
+        elif self.config.has_option(self.name, 'hourly_sync'):
+            try:
+                hourly = parse_hours(self.config.get(self.name, 'hourly_sync'))
+            except ValueError as e:
+                raise RepoConfigError("Invalid hourly_sync: {0}".format(e), self.name)
 
         if not self.config.has_option(self.name, 'pre_command'):
             self.config.set(self.name, 'pre_command', '')
@@ -77,10 +136,123 @@ class Repo(object):
         if not self.config.has_option(self.name, 'post_command'):
             self.config.set(self.name, 'post_command', '')
 
+        # time options which default to the GLOBAL setting
+        for option in ['sleep_jitter', 'max_runtime', 'stall_timeout']:
+            if not self.config.has_option(self.name, option):
+                self.config.set(self.name, option, self.config.get("GLOBAL", option))
+            try:
+                t2s(self.config.get(self.name, option))
+            except (ValueError, KeyError, IndexError):
+                raise RepoConfigError("Invalid {0} {1}".format(option, self.config.get(self.name, option)), self.name)
+
+        if not self.config.has_option(self.name, 'progress'):
+            self.config.set(self.name, 'progress', self.config.get("GLOBAL", "progress"))
+        try:
+            self.config.getboolean(self.name, 'progress')
+        except ValueError:
+            raise RepoConfigError("Invalid progress {0}".format(self.config.get(self.name, 'progress')), self.name)
+
+        if not self.config.has_option(self.name, 'probe'):
+            self.config.set(self.name, 'probe', '')
+
+        if not self.config.has_option(self.name, 'shards'):
+            self.config.set(self.name, 'shards', '1')
+        try:
+            if self.config.getint(self.name, 'shards') < 1:
+                raise ValueError
+        except ValueError:
+            raise RepoConfigError("Invalid shards {0}, must be at least 1".format(self.config.get(self.name, 'shards')), self.name)
+
+        if not self.config.has_option(self.name, 'manifest'):
+            self.config.set(self.name, 'manifest', '')
+
+        if not self.config.has_option(self.name, 'manifest_processes'):
+            self.config.set(self.name, 'manifest_processes', '2')
+        try:
+            if self.config.getint(self.name, 'manifest_processes') < 1:
+                raise ValueError
+        except ValueError:
+            raise RepoConfigError("Invalid manifest_processes {0}, must be at least 1".format(self.config.get(self.name, 'manifest_processes')), self.name)
+
+        if not self.config.has_option(self.name, 'snapshots'):
+            self.config.set(self.name, 'snapshots', 'False')
+        try:
+            self.config.getboolean(self.name, 'snapshots')
+        except ValueError:
+            raise RepoConfigError("Invalid snapshots {0}".format(self.config.get(self.name, 'snapshots')), self.name)
+
+        if not self.config.has_option(self.name, 'snapshot_keep'):
+            self.config.set(self.name, 'snapshot_keep', '2')
+        try:
+            if self.config.getint(self.name, 'snapshot_keep') < 1:
+                raise ValueError
+        except ValueError:
+            raise RepoConfigError("Invalid snapshot_keep {0}, must be at least 1".format(self.config.get(self.name, 'snapshot_keep')), self.name)
+
+        # process priority options which default to the GLOBAL setting
+        for option in ['nice', 'ionice_class', 'ionice_level', 'ionice_weight']:
+            if not self.config.has_option(self.name, option):
+                self.config.set(self.name, option, self.config.get("GLOBAL", option))
+
+        try:
+            nice = self.config.getint(self.name, 'nice')
+            if not -20 <= nice <= 19:
+                raise ValueError
+        except ValueError:
+            raise RepoConfigError("Invalid nice {0}, must be between -20 and 19".format(self.config.get(self.name, 'nice')), self.name)
+        io_class = self.config.get(self.name, 'ionice_class')
+        if io_class not in IOPRIO_CLASSES and io_class != "none":
+            raise RepoConfigError("Unknown ionice_class {0}, must be none, {1}".format(io_class, ", ".join(sorted(IOPRIO_CLASSES))), self.name)
+        try:
+            io_level = self.config.getint(self.name, 'ionice_level')
+            if not 0 <= io_level <= 7:
+                raise ValueError
+        except ValueError:
+            raise RepoConfigError("Invalid ionice_level {0}, must be between 0 and 7".format(self.config.get(self.name, 'ionice_level')), self.name)
+        try:
+            if self.config.getboolean(self.name, 'ionice_weight'):
+                # lower weights sync first, so they also get the higher I/O priority
+                io_class = io_class if io_class != "none" else "best-effort"
+                io_level = max(0, min(7, io_level + self.config.getint(self.name, 'weight')))
+        except ValueError:
+            raise RepoConfigError("Invalid ionice_weight {0} or weight {1}".format(self.config.get(self.name, 'ionice_weight'), self.config.get(self.name, 'weight')), self.name)
+        if io_class != "none" and not ioprio_supported():
+            raise RepoConfigError("ionice_class requires Linux", self.name)
+        if (nice < 0 or io_class == "realtime") and os.geteuid() != 0:
+            raise RepoConfigError("A negative nice or the realtime ionice_class requires root", self.name)
+
         if not self.config.has_option(self.name, 'log_file'):
             self.config.set(self.name, 'log_file', './log/{0}.log'.format(self.name))
             logging.info("No log_file declared in {0}, defaulting to '{0}.log'".format(self.name))
+
+        # log options which default to the GLOBAL setting
+        for option in ['log_max_size', 'log_max_age', 'log_keep', 'log_compress', 'index_file']:
+            if not self.config.has_option(self.name, option):
+                self.config.set(self.name, option, self.config.get("GLOBAL", option))
+
+        try:
+            max_size = h2b(self.config.get(self.name, 'log_max_size'))
+        except ValueError:
+            raise RepoConfigError("Invalid log_max_size {0}".format(self.config.get(self.name, 'log_max_size')), self.name)
+        try:
+            max_age = t2s(self.config.get(self.name, 'log_max_age'))
+        except (ValueError, KeyError, IndexError):
+            raise RepoConfigError("Invalid log_max_age {0}".format(self.config.get(self.name, 'log_max_age')), self.name)
+        try:
+            keep = self.config.getint(self.name, 'log_keep')
+        except ValueError:
+            raise RepoConfigError("Invalid log_keep {0}".format(self.config.get(self.name, 'log_keep')), self.name)
+        compress = self.config.get(self.name, 'log_compress')
+        if compress not in COMPRESSORS and compress != "none":
+            raise RepoConfigError("Unknown log_compress {0}, must be none, {1}".format(compress, ", ".join(sorted(COMPRESSORS))), self.name)
         # end config validation section
+        self.hourly = hourly
+
+        # preexec_fn of every process of a sync, None to inherit the daemon's priority
+        if nice or io_class != "none":
+            self.priority = Priority(nice, io_class if io_class != "none" else None, io_level)
+        else:
+            self.priority = None
 
         log_file = self.config.get(self.name, "log_file")
         directory = os.path.dirname(log_file)
@@ -96,17 +268,45 @@ class Repo(object):
         except IOError:
             logging.error("Error opening {0} for writing".format(self.name))
 
-        if(self.deactive):
-            logging.info("{0} loaded successfully, but disabled".format(self.name))
-        else:
-            logging.info("{0} loaded successfully".format(self.name))
+        # rotates log_file between syncs
+        self.log = LogRotator(log_file, max_size, max_age, keep, compress if compress != "none" else None, self.repo_manager.compressor)
+
+    def reconfigure(self, options):
+        """Replace the config section of the repo and validate it again.
+
+        A running sync reads the section as it goes, so only reconfigure a
+        repo which isn't syncing. deactive is left for the caller to apply.
+
+        :param dict options: raw option values of the new section
+        :raises Repo.RepoConfigError: if the new section is invalid, the old one is kept
+        """
+        old = self.config.items(self.name, raw=True)
+        replace_section(self.config, self.name, options)
+        try:
+            self.__configure()
+        except RepoConfigError:
+            replace_section(self.config, self.name, dict(old))
+            raise
 
     def is_alive(self):
         """Bool of syncing status."""
         if self.__sync:
-            return bool(self.__sync.p)
+            return bool(self.__sync.p or self.__sync.hook)
         return False
 
+    def progress(self):
+        """Transfer metrics of the running or last sync.
+
+        Only available for repos with progress enabled.
+
+        :rtype: RsyncProgress
+        :returns: RsyncProgress of the current or last sync
+        :rtype: None
+        :returns: None if progress is disabled or the repo hasn't synced
+        """
+        if self.__sync:
+            return self.__sync.progress
+
     def running_time(self):
         """Total running time of active sync.
 
@@ -133,6 +333,17 @@ class Repo(object):
                 delta = datetime.now() - self.__sync.sleep_start
                 return delta - timedelta(microseconds=delta.microseconds)
 
+    def shards(self):
+        """Progress of a sharded sync.
+
+        :rtype: tuple
+        :returns: tuple of shards finished and total shards
+        :rtype: None
+        :returns: None if the repo isn't running its shards
+        """
+        if self.__sync and isinstance(self.__sync.p, ProcessGroup):
+            return (self.__sync.p.done(), len(self.__sync.p.procs))
+
     def time_remaining(self):
         """Return time left until sleep is over.
 
@@ -141,46 +352,113 @@ class Repo(object):
         :rtype: None
         :returns: None if not in sleeping state
         """
-        if self.__sync:
-            if self.__sync.sleep_start:
-                delta = timedelta(seconds=t2s(self.config.get(self.name, "async_sleep"))) - self.sleep_time()
-                return delta - timedelta(microseconds=delta.microseconds)
+        remaining = self.repo_manager.scheduler.time_remaining(self.name)
+        if remaining is not None:
+            return timedelta(seconds=int(remaining))
+
+    def next_sync_time(self, after=None):
+        """Time the next sync is due after a sync finishing at a given time.
 
-    def terminate(self):
-        """Send SIGTERM To the rsync process."""
+        hourly_sync repos are shifted by a stable per repo offset inside the
+        GLOBAL hourly_spread window, so repos sharing a scheduled hour don't
+        all queue at once.
+
+        :param float after: unix timestamp the last sync finished, default is now
+        :rtype: float
+        :returns: unix timestamp of the next sync
+        """
+        if after is None:
+            after = time.time()
+        if self.hourly:
+            spread = t2s(self.config.get("GLOBAL", "hourly_spread"))
+            return next_hourly(self.hourly, after, offset=stable_offset(self.name, spread))
+        return after + t2s(self.config.get(self.name, "async_sleep"))
+
+    def last_activity(self):
+        """Last time the running sync showed signs of progress.
+
+        Activity is output read from rsync or a write to the repo log file.
+
+        :rtype: float
+        :returns: unix timestamp of the last activity
+        :rtype: None
+        :returns: None if not syncing or running a hook
+        """
+        if self.is_alive() and not self.__sync.in_hooks:
+            activity = [time.mktime(self.__sync.start_time.timetuple()), self.__sync.last_output]
+            try:
+                activity.append(os.path.getmtime(self.config.get(self.name, "log_file")))
+            except OSError:
+                pass
+            return max(activity)
+
+    def in_hooks(self):
+        """Bool of whether the running sync is running or waiting for a hook."""
+        return bool(self.is_alive() and self.__sync.in_hooks)
+
+    def terminated_at(self):
+        """Time SIGTERM was sent to the running sync.
+
+        :rtype: float
+        :returns: unix timestamp of the first SIGTERM
+        :rtype: None
+        :returns: None if not syncing or not terminated
+        """
+        if self.is_alive():
+            return self.__sync.terminated
+
+    def terminate(self, requeue=False):
+        """Send SIGTERM To the running process of the sync.
+
+        :param bool requeue: skip post_command and queue the repo again once it exits
+        """
         if self.is_alive():
             logging.info("Terminating {0}".format(self.name))
-            self.__sync.p.terminate()
+            self.__sync.signal(signal.SIGTERM, requeue)
+
+    def kill(self, requeue=False):
+        """Send SIGKILL To the running process of the sync.
 
-    def kill(self):
-        """Send SIGKILL To the rsync process."""
+        :param bool requeue: skip post_command and queue the repo again once it exits
+        """
         if self.is_alive():
             logging.info("KIlling {0}".format(self.name))
-            self.__sync.p.kill()
+            self.__sync.signal(signal.SIGKILL, requeue)
 
     def __rebuild(self):
         """Destroy and recreate the rsync object and settings.
 
         This will wipe all currently running rsync timers
         """
-        self.__sync = self.rsync_thread(self.name, self.config)
+        if self.repo_manager.supervisor is not None:
+            self.__sync = self.rsync_job(self.name, self.config)
+        else:
+            self.__sync = self.rsync_thread(self.name, self.config)
 
     def start_sync(self):
         """Run an rsync against the repo source."""
         self.__rebuild()
-        self.__sync.start()
+        if self.repo_manager.supervisor is not None:
+            self.repo_manager.supervisor.add(self.__sync)
+        else:
+            self.__sync.start()
 
-    class rsync_thread(threading.Thread):
-        """Extended threading.Thread class to control rsync via subprocess.
+    class rsync_job(object):
+        """A single sync of a repo, independent of how it is waited on.
+
+        steps() starts each process of the sync in turn and yields it. The
+        engine driving the job resumes the generator once that process has
+        exited.
 
         :param str name: Name of repo
         :param config: Running config options
         :type config: Configparser.Configparser
         """
         def __init__(self, name, config):
-            threading.Thread.__init__(self)
             self.config = config
             self.p = None
+            # pre_command, post_command or other hook being run or waited for
+            self.hook = None
             self.name = name
 
             # Singleton of RepoManager
@@ -188,77 +466,476 @@ class Repo(object):
 
             self.start_time = None
             self.finish_time = None
-            self.start_sleep = None
-            self.thread_timer = None
+            self.sleep_start = None
 
-            self.daemon = True
+            # log file for the duration of the sync
+            self.output_file = None
+            self.log = self.repo_manager.get_repo(name).log
 
-        def run(self):
+            # nice and ionice of the processes of the sync
+            self.priority = self.repo_manager.get_repo(name).priority
+
+            # exit code of rsync, None until it has exited
+            self.returncode = None
+
+            # unix timestamp output was last read from rsync
+            self.last_output = None
+
+            # set while a hook runs, which isn't watched for stalls
+            self.in_hooks = False
+
+            # set once the sync slot was given back
+            self.released = False
+
+            # set when the sync was stopped to be run again right away
+            self.requeue = False
+
+            # unix timestamp SIGTERM was first sent
+            self.terminated = None
+
+            # classified result, set once the sync has finished
+            self.outcome = None
+
+            # set when rsync is restarted to pick up a new bandwidth limit
+            self.rebalance = False
+
+            # absolute path of the snapshot this sync published, snapshot mode only
+            self.snapshot = None
+
+            # digest of the upstream probe file, None if not probed
+            self.probe_value = None
+
+            # set when the sync was skipped since the probe file is unchanged
+            self.skipped = False
+
+            # with progress enabled rsync output is piped through a parser
+            if self.config.getboolean(self.name, "progress"):
+                self.progress = RsyncProgress()
+            else:
+                self.progress = None
+
+            # hook slot taken for pre_command when the repo was dispatched, handed over to the job
+            repo = self.repo_manager.get_repo(name)
+            self.pre_ticket, repo.pre_ticket = repo.pre_ticket, None
+
+        def throttle(self):
+            """Restart the running rsync to apply a new bandwidth limit."""
+            if self.p and self.p.poll() is None:
+                logging.info("Restarting {0} to change bandwidth limit".format(self.name))
+                self.rebalance = True
+                self.p.terminate()
+
+        def signal(self, signum, requeue=False):
+            """Send a signal to whichever process of the sync is running.
+
+            :param int signum: Signal to send
+            :param bool requeue: skip post_command and queue the repo again once it exits
+            """
+            if requeue:
+                self.requeue = True
+            if signum in (signal.SIGTERM, signal.SIGKILL) and not self.terminated:
+                self.terminated = time.time()
+            for proc in [self.p, self.hook]:
+                if proc and proc.poll() is None:
+                    proc.send_signal(signum)
+                    return
+
+        def read_output(self, data):
+            """Handle output read from the rsync pipe.
+
+            Engines call this with every chunk read from the stdout of a
+            yielded process which has one.
+
+            :param str data: raw output of rsync
+            """
+            self.last_output = time.time()
+            self.output_file.write(data)
+            self.progress.feed(data)
+
+        def release(self):
+            """Give back the sync slot and bandwidth once rsync is done."""
+            if not self.released:
+                self.released = True
+                self.repo_manager.free_bandwidth(self)
+                self.repo_manager.release_slot(self.name)
+
+        def run_hook(self, event, args, ticket=None, **kwargs):
+            """Generator running a command in the hook pool.
+
+            Yields a HookTicket until a hook slot is free, then the command's
+            process. Afterwards self.hook holds the process, or the ticket if
+            the sync was stopped before the command ran.
+
+            :param str event: Name of the phase, for its event
+            :param args: command passed to subprocess.Popen
+            :param ticket: Ticket already holding a hook slot, default is to wait for one
+            :type ticket: HookTicket
+            :param kwargs: extra subprocess.Popen arguments
+            :rtype: subprocess.Popen or HookTicket
+            :returns: each process to wait on
+            """
+            self.in_hooks = True
+            try:
+                self.hook = ticket or self.repo_manager.hooks.acquire()
+                yield self.hook
+                if self.hook.returncode != 0:
+                    return
+                try:
+                    if self.terminated:
+                        self.hook.returncode = -signal.SIGTERM
+                        return
+                    started = time.time()
+                    self.output_file.flush()
+                    self.hook = subprocess.Popen(args, stdout=self.output_file, stderr=subprocess.STDOUT, close_fds=True, preexec_fn=self.priority, **kwargs)
+                    yield self.hook
+                    self.phase(event, started, self.hook.returncode)
+                finally:
+                    self.repo_manager.hooks.release()
+            finally:
+                self.in_hooks = False
+
+        def phase(self, event, started, exit_code=None, **fields):
+            """Emit the event of a finished phase of the sync.
+
+            :param str event: Name of the phase
+            :param float started: unix timestamp the phase started
+            :param int exit_code: exit code of the phase's process
+            """
+            self.repo_manager.emit(event, self.name, start=started, duration=time.time() - started, exit_code=exit_code, **fields)
+
+        def steps(self):
+            """Generator running pre_command, rsync then post_command.
+
+            pre_command and post_command run in the hook pool. A repo with a
+            pre_command is only dispatched once a hook slot is free, and runs
+            it first, so it never waits for one while holding its sync slot.
+            The sync slot is given back as soon as rsync is done, so hooks
+            don't keep other syncs from starting, and the next sync is
+            scheduled once the hooks finish.
+
+            With more than one shard the top level directories of the source
+            are listed and split across parallel rsyncs, waited on as one
+            ProcessGroup. Once they all succeed a non recursive rsync of the
+            top level copies its files and applies any --delete to it.
+
+            With a manifest set, a complete sync is followed by a mirrors.manifest
+            process updating it, before post_command runs.
+
+            With a probe set, the probe file is fetched first and the sync is
+            skipped if it is unchanged since the last successful sync.
+
+            In snapshot mode rsync syncs into a staging directory, hardlinking
+            unchanged files to the current snapshot. Once rsync and
+            post_command succeed the staging directory is published and
+            snapshots beyond snapshot_keep are deleted.
+
+            :rtype: subprocess.Popen
+            :returns: each process started, to be resumed after it exits
+            """
+            self.log.rotate()
             logging.debug("Opening {0} for writing".format(self.config.get(self.name, 'log_file')))
-            output_file = open(self.config.get(self.name, 'log_file'), 'a')
-
-            logging.debug("Running rsync with {0} {1} {2}".format(
-                self.config.get(self.name, "rsync_args"),
-                self.config.get(self.name, "source"),
-                self.config.get(self.name, "destination")))
-
-            self.start_time = datetime.now()
-            logging.info("Starting sync {0} at {1}".format(self.name, self.start_time))
-
-            self.p = subprocess.Popen("rsync {0} {1} {2}".format(
-                self.config.get(self.name, "rsync_args"),
-                self.config.get(self.name, "source"),
-                self.config.get(self.name, "destination")).split(),
-                shell=False,
-                stdout=output_file,
-                stderr=subprocess.STDOUT)
-            # bock until the subprocess is done
-            self.p.wait()
-
-            if self.config.get(self.name, "post_command"):
-                logging.debug("running post_cmd {0}".format(self.config.get(self.name, "post_command")))
-                self.post_cmd = subprocess.Popen("{0}".format(
-                    self.config.get(self.name, "post_command")),
-                    shell=True,
-                    stdout=output_file,
-                    stderr=subprocess.STDOUT)
-                self.post_cmd.wait()
-                logging.info("Done running post_command for {0}".format(self.name))
-
-            t = t2s(self.config.get(self.name, "async_sleep"))
-            self.thread_timer = threading.Timer(t, self.repo_manager.enqueue, [self.name])
-            self.thread_timer.start()
-
-            # Time that thread starts sleeping
-            self.sleep_start = datetime.now()
-
-            # clear out the current process when it finishes
-            self.p = None
+            # only output piped through read_output is buffered, rsync writes to the file directly otherwise
+            output_file = self.output_file = open(self.config.get(self.name, 'log_file'), 'a', 65536)
+
+            next_sync = None
+            try:
+                logging.debug("Running rsync with {0} {1} {2}".format(
+                    self.config.get(self.name, "rsync_args"),
+                    self.config.get(self.name, "source"),
+                    self.config.get(self.name, "destination")))
+
+                self.start_time = datetime.now()
+                logging.info("Starting sync {0} at {1}".format(self.name, self.start_time))
+
+                destination = self.config.get(self.name, "destination")
+                snapshots = self.config.getboolean(self.name, "snapshots")
+                target = destination
+                if snapshots:
+                    if not os.path.isdir(snapshot_dir(destination)):
+                        os.makedirs(snapshot_dir(destination))
+                    target = staging_path(destination) + "/"
+
+                # the hook slot was taken at dispatch, so this never waits while holding the sync slot
+                if self.config.get(self.name, "pre_command"):
+                    logging.debug("running pre_command {0}".format(self.config.get(self.name, "pre_command")))
+                    ticket, self.pre_ticket = self.pre_ticket, None
+                    for proc in self.run_hook("pre_command", self.config.get(self.name, "pre_command"), ticket,
+                                              shell=True, env=dict(os.environ, MIRRORS_TARGET=target)):
+                        yield proc
+                    if self.hook.returncode != 0:
+                        logging.warning("pre_command of {0} exited with {1}, not syncing".format(self.name, self.hook.returncode))
+                        return
+
+                if self.config.get(self.name, "probe"):
+                    url = probe_url(self.config.get(self.name, "source"), self.config.get(self.name, "probe"))
+                    fd, probe_file = tempfile.mkstemp(prefix="{0}.".format(self.name), suffix=".probe")
+                    os.close(fd)
+                    try:
+                        started = time.time()
+                        self.p = subprocess.Popen([self.config.get("GLOBAL", "rsync_path"), url, probe_file], stdout=output_file, stderr=subprocess.STDOUT,
+                                                  close_fds=True, preexec_fn=self.priority)
+                        yield self.p
+                        self.phase("probe", started, self.p.returncode)
+                        if self.p.returncode == 0:
+                            with open(probe_file) as f:
+                                self.probe_value = hashlib.sha1(f.read()).hexdigest()
+                        else:
+                            logging.warning("Probe of {0} exited with {1}, syncing anyway".format(self.name, self.p.returncode))
+                    finally:
+                        os.unlink(probe_file)
+
+                    if self.terminated:
+                        return
+                    if self.probe_value and self.probe_value == self.repo_manager.last_probe(self.name):
+                        logging.info("{0} is unchanged upstream, skipping sync".format(self.name))
+                        self.skipped = True
+                        return
+
+                source = self.config.get(self.name, "source")
+                groups = None
+                shards = min(self.config.getint(self.name, "shards"), self.repo_manager.connections(self.name))
+                if shards < self.config.getint(self.name, "shards"):
+                    logging.info("{0} limited to {1} shards by free connections to its host".format(self.name, shards))
+                if shards > 1:
+                    fd, listing_file = tempfile.mkstemp(prefix="{0}.".format(self.name), suffix=".list")
+                    os.close(fd)
+                    try:
+                        started = time.time()
+                        with open(listing_file, 'w') as listing_out:
+                            self.p = subprocess.Popen([self.config.get("GLOBAL", "rsync_path"), "--list-only", source.rstrip("/") + "/"], stdout=listing_out, stderr=output_file,
+                                                      close_fds=True, preexec_fn=self.priority)
+                        yield self.p
+                        self.phase("listing", started, self.p.returncode)
+                        with open(listing_file) as f:
+                            listing = f.read()
+                    finally:
+                        os.unlink(listing_file)
+                    if self.terminated:
+                        return
+                    if self.p.returncode == 0:
+                        groups = split_shards(parse_listing(listing), shards)
+                        logging.info("Syncing {0} in {1} shards".format(self.name, len(groups)))
+                    else:
+                        logging.warning("Listing {0} exited with {1}, syncing in one stream".format(self.name, self.p.returncode))
+
+                while(True):
+                    rsync_args = self.config.get(self.name, "rsync_args")
+                    # shards write straight to the log, their progress lines would interleave
+                    if self.progress and not groups:
+                        rsync_args += " --info=progress2 --stats"
+
+                    # hardlink files unchanged since the current snapshot
+                    if snapshots and current_snapshot(destination):
+                        rsync_args += " --link-dest={0}".format(current_snapshot(destination))
+
+                    bwlimit = self.repo_manager.allocate_bandwidth(self)
+                    if bwlimit and groups:
+                        rsync_args += " --bwlimit={0}".format(max(1, bwlimit // len(groups)))
+                    elif bwlimit:
+                        rsync_args += " --bwlimit={0}".format(bwlimit)
+
+                    started = time.time()
+                    if groups:
+                        self.p = ProcessGroup([subprocess.Popen(
+                            [self.config.get("GLOBAL", "rsync_path")] + rsync_args.split() + ["{0}/{1}".format(source.rstrip("/"), name) for name in group] + [target],
+                            shell=False,
+                            stdout=output_file,
+                            stderr=subprocess.STDOUT,
+                            close_fds=True,
+                            preexec_fn=self.priority) for group in groups])
+                    else:
+                        self.p = subprocess.Popen("{0} {1} {2} {3}".format(
+                            self.config.get("GLOBAL", "rsync_path"),
+                            rsync_args,
+                            source,
+                            target).split(),
+                            shell=False,
+                            stdout=subprocess.PIPE if self.progress else output_file,
+                            stderr=subprocess.STDOUT,
+                            close_fds=True,
+                            preexec_fn=self.priority)
+                    yield self.p
+                    self.returncode = self.p.returncode
+                    self.phase("rsync", started, self.returncode, bwlimit=bwlimit, shards=len(groups) if groups else 1)
+
+                    # rsync was stopped by throttle(), run it again with the new limit
+                    if not self.rebalance or self.p.returncode == 0:
+                        break
+                    self.rebalance = False
+
+                # top level files and deletes, only once every shard is complete
+                if groups and not self.terminated and classify_exit(self.returncode) in ("success", "partial"):
+                    started = time.time()
+                    self.p = subprocess.Popen("{0} {1} -d --no-recursive {2}/ {3}".format(
+                        self.config.get("GLOBAL", "rsync_path"),
+                        rsync_args,
+                        source.rstrip("/"),
+                        target).split(),
+                        shell=False,
+                        stdout=output_file,
+                        stderr=subprocess.STDOUT,
+                        close_fds=True,
+                        preexec_fn=self.priority)
+                    yield self.p
+                    self.phase("top_level", started, self.p.returncode)
+                    self.returncode = worst_exit([self.returncode, self.p.returncode])
+
+                # hooks don't use the network
+                self.release()
+
+                complete = not self.requeue and not self.terminated and classify_exit(self.returncode) in ("success", "partial")
+                # only a complete transfer is published
+                publishable = snapshots and complete
+
+                # hashing runs in its own process, which forks its pool without this one's threads
+                if self.config.get(self.name, "manifest") and complete:
+                    logging.debug("Updating manifest {0}".format(self.config.get(self.name, "manifest")))
+                    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                    for proc in self.run_hook("manifest", [sys.executable, "-m", "mirrors.manifest",
+                                                           "-p", self.config.get(self.name, "manifest_processes"),
+                                                           target, self.config.get(self.name, "manifest")],
+                                              env=dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package, os.environ.get("PYTHONPATH")])))):
+                        yield proc
+                    if self.hook.returncode != 0:
+                        logging.warning("Manifest of {0} exited with {1}".format(self.name, self.hook.returncode))
+                        publishable = False
+
+                if self.config.get(self.name, "post_command") and not self.requeue:
+                    logging.debug("running post_command {0}".format(self.config.get(self.name, "post_command")))
+                    for proc in self.run_hook("post_command", self.config.get(self.name, "post_command"),
+                                              shell=True, env=dict(os.environ, MIRRORS_TARGET=target)):
+                        yield proc
+                    logging.info("Done running post_command for {0}".format(self.name))
+                    if publishable and self.hook.returncode != 0:
+                        logging.warning("Not publishing {0}, post_command exited with {1}".format(self.name, self.hook.returncode))
+                        publishable = False
+
+                if publishable:
+                    started = time.time()
+                    try:
+                        self.snapshot = publish(destination)
+                    except OSError as e:
+                        logging.error("Failed to publish snapshot of {0}: {1}".format(self.name, e))
+                    else:
+                        self.phase("publish", started, snapshot=self.snapshot)
+                        old = expired(destination, self.config.getint(self.name, "snapshot_keep"))
+                        if old:
+                            logging.info("Deleting {0} old snapshots of {1}".format(len(old), self.name))
+                            for proc in self.run_hook("prune", ["rm", "-rf"] + old):
+                                yield proc
+            finally:
+                # Give the slot back to the dispatcher, if rsync never finished
+                self.release()
+                if self.pre_ticket is not None:
+                    self.repo_manager.hooks.release()
+                    self.pre_ticket = None
+
+                # clear out the current process when it finishes
+                self.p = None
+                self.hook = None
+
+                self.finish_time = datetime.now()
+
+                logging.debug("closing {0}".format(self.config.get(self.name, 'log_file')))
+                output_file.close()
+                self.log.rotate()
+
+                # Time that thread starts sleeping
+                self.sleep_start = datetime.now()
+
+                # a failed sync is still rescheduled so the repo isn't lost
+                next_sync = self.repo_manager.finish_sync(self)
+
+            if next_sync is None:
+                logging.info("finished {0} at {1}, removed".format(self.name, self.finish_time))
+            else:
+                logging.info("finished {0} at {1}, next sync at {2}".format(self.name, self.finish_time, datetime.fromtimestamp(int(next_sync))))
+
+    class rsync_thread(threading.Thread, rsync_job):
+        """Extended threading.Thread class to control rsync via subprocess.
 
-            # Remove state from running_syncs
-            self.repo_manager.running_syncs -= 1
+        Runs an rsync_job, blocking on each process in turn.
 
-            self.finish_time = datetime.now()
-            logging.info("finished {0} at {1}, sleeping for {2}".format(self.name, self.finish_time, self.config.get(self.name, "async_sleep")))
+        :param str name: Name of repo
+        :param config: Running config options
+        :type config: Configparser.Configparser
+        """
+        def __init__(self, name, config):
+            threading.Thread.__init__(self)
+            Repo.rsync_job.__init__(self, name, config)
+
+            self.daemon = True
 
-            logging.debug("closing {0}".format(self.config.get(self.name, 'log_file')))
-            output_file.close()
+        def run(self):
+            try:
+                for proc in self.steps():
+                    if proc.stdout:
+                        for data in iter(lambda: os.read(proc.stdout.fileno(), 65536), ''):
+                            self.read_output(data)
+                        proc.stdout.close()
+                    # block until the subprocess is done
+                    proc.wait()
+            except Exception:
+                logging.exception("Sync of {0} failed".format(self.name))
 
 
 class RepoManager(object):
     __metaclass__ = Singleton
 
-    def __init__(self, config):
+    # columns of a status row, see snapshot()
+    status_columns = ("name", "state", "since", "deactive", "weight", "host", "next_sync", "started",
+                      "last_outcome", "last_exit", "last_duration", "last_success", "last_bytes", "failures", "bytes")
+
+    # GLOBAL options only read at startup, changing them needs a restart
+    restart_options = ("engine", "policy", "state_file", "event_log", "hook_processes", "metrics_port",
+                       "metrics_address", "control_socket", "log_file")
+
+    # GLOBAL options repos default to, see Repo
+    inherited_options = ("sleep_jitter", "max_runtime", "stall_timeout", "progress", "log_max_size",
+                         "log_max_age", "log_keep", "log_compress", "index_file", "nice", "ionice_class",
+                         "ionice_level", "ionice_weight")
+
+    # GLOBAL option -> function raising ValueError on an invalid value, checked before a reload applies it
+    global_checks = dict([(option, int) for option in ("async_processes", "host_connections", "total_bandwidth",
+                                                       "breaker_threshold", "log_keep")] +
+                         [(option, t2s) for option in ("hourly_spread", "startup_window", "sleep_jitter", "max_runtime",
+                                                       "stall_timeout", "kill_grace", "retry_base", "retry_max",
+                                                       "breaker_cooldown", "log_max_age")] +
+                         [(option, parse_bool) for option in ("progress", "ionice_weight")] +
+                         [("bandwidth_regrow", float), ("log_max_size", h2b), ("host_limits", parse_limits),
+                          ("nice", lambda s: parse_int(s, -20, 19)), ("ionice_level", lambda s: parse_int(s, 0, 7))])
+
+    # GLOBAL option -> values a reload may set it to
+    global_choices = {"reload_removed": ("drain", "terminate"),
+                      "log_compress": tuple(sorted(COMPRESSORS)) + ("none",),
+                      "ionice_class": tuple(sorted(IOPRIO_CLASSES)) + ("none",)}
+
+    def __init__(self, config, config_file=None):
         """Singleton manager of the repositories and threading.
 
         :param config: Running config options
         :type config: Configparser.Configparser
+        :param str config_file: Location config was read from, see reload()
         """
         # configparser object which all of the repomanager configs are stored under the GLOBAL Section
         self.config = config
-
-        # priority queue for async processing
-        self.repo_queue = Queue.PriorityQueue(0)
+        self.config_file = config_file
+
+        # section -> raw options as last read from config_file, before defaults are filled in
+        self.__loaded = dict((section, dict(config.items(section, raw=True))) for section in config.sections())
+        # serializes reloads
+        self.__reload_lock = threading.Lock()
+        # name -> options to apply once the running sync of the repo is done, guarded by __dispatch
+        self.__pending = dict()
+        # names of removed repos whose running sync is draining, guarded by __dispatch
+        self.__removing = set()
+
+        # heap of [policy key, count, repo] for async processing
+        self.repo_queue = []
+        # tie breaker so repos with equal keys run in the order queued
+        self.__counter = itertools.count()
+        # guards repo_queue and running_syncs, notified on enqueue and slot release
+        self.__dispatch = threading.Condition()
         # list of repo objects
         self._repo_dict = dict()
 
@@ -268,40 +945,721 @@ class RepoManager(object):
         if not self.config.has_option('GLOBAL', 'async_processes'):
             raise GlobalError("No async_processes value defined in GLOBAL")
 
-        if not self.config.has_option('GLOBAL', 'check_sleep'):
-            config.set("GLOBAL", 'check_sleep', '30')
+        if not self.config.has_option('GLOBAL', 'rsync_path'):
+            self.config.set("GLOBAL", 'rsync_path', 'rsync')
+
+        if not self.config.has_option('GLOBAL', 'hourly_spread'):
+            self.config.set("GLOBAL", 'hourly_spread', '5m')
+
+        if not self.config.has_option('GLOBAL', 'startup_window'):
+            self.config.set("GLOBAL", 'startup_window', '0s')
+
+        if not self.config.has_option('GLOBAL', 'sleep_jitter'):
+            self.config.set("GLOBAL", 'sleep_jitter', '0s')
+
+        if not self.config.has_option('GLOBAL', 'max_runtime'):
+            self.config.set("GLOBAL", 'max_runtime', '0s')
+
+        if not self.config.has_option('GLOBAL', 'stall_timeout'):
+            self.config.set("GLOBAL", 'stall_timeout', '0s')
+
+        if not self.config.has_option('GLOBAL', 'kill_grace'):
+            self.config.set("GLOBAL", 'kill_grace', '30s')
+
+        if not self.config.has_option('GLOBAL', 'progress'):
+            self.config.set("GLOBAL", 'progress', 'False')
+
+        if not self.config.has_option('GLOBAL', 'total_bandwidth'):
+            self.config.set("GLOBAL", 'total_bandwidth', '0')
+
+        if not self.config.has_option('GLOBAL', 'bandwidth_regrow'):
+            self.config.set("GLOBAL", 'bandwidth_regrow', '2')
+
+        if not self.config.has_option('GLOBAL', 'reload_removed'):
+            self.config.set("GLOBAL", 'reload_removed', 'drain')
+
+        if self.config.get("GLOBAL", "reload_removed") not in ("drain", "terminate"):
+            raise GlobalError("Unknown reload_removed {0}, must be drain or terminate".format(self.config.get("GLOBAL", "reload_removed")))
+
+        # running rsync_job -> --bwlimit it was given
+        self.__bandwidth = dict()
+        self.__bandwidth_lock = threading.Lock()
+
+        if not self.config.has_option('GLOBAL', 'state_file'):
+            self.config.set("GLOBAL", 'state_file', '')
+
+        # sync history, kept across restarts
+        if self.config.get("GLOBAL", "state_file"):
+            try:
+                self.state = StateStore(self.config.get("GLOBAL", "state_file"))
+            except sqlite3.Error as e:
+                raise GlobalError("Failed to open state_file {0}: {1}".format(self.config.get("GLOBAL", "state_file"), e))
+        else:
+            self.state = None
+
+        if not self.config.has_option('GLOBAL', 'host_connections'):
+            self.config.set("GLOBAL", 'host_connections', '0')
+
+        if not self.config.has_option('GLOBAL', 'host_limits'):
+            self.config.set("GLOBAL", 'host_limits', '')
+
+        # host -> max concurrent syncs, overriding host_connections
+        try:
+            self.host_limits = parse_limits(self.config.get("GLOBAL", "host_limits"))
+        except ValueError:
+            raise GlobalError("Invalid host_limits {0}".format(self.config.get("GLOBAL", "host_limits")))
+        # host -> open connections, running repo name -> host and running repo name -> its connections,
+        # guarded by __dispatch
+        self.__host_syncs = dict()
+        self.__running_hosts = dict()
+        self.__running_connections = dict()
+
+        if not self.config.has_option('GLOBAL', 'policy'):
+            self.config.set("GLOBAL", 'policy', 'weight')
+
+        # orders the queue
+        if self.config.get("GLOBAL", "policy") not in POLICIES:
+            raise GlobalError("Unknown policy {0}, must be one of {1}".format(self.config.get("GLOBAL", "policy"), ", ".join(sorted(POLICIES))))
+        self.policy = POLICIES[self.config.get("GLOBAL", "policy")](self)
+
+        # name -> moving average of successful sync durations in seconds
+        self.durations = dict()
+
+        if not self.config.has_option('GLOBAL', 'retry_base'):
+            self.config.set("GLOBAL", 'retry_base', '30s')
+
+        if not self.config.has_option('GLOBAL', 'retry_max'):
+            self.config.set("GLOBAL", 'retry_max', '1h')
+
+        if not self.config.has_option('GLOBAL', 'breaker_threshold'):
+            self.config.set("GLOBAL", 'breaker_threshold', '5')
+
+        if not self.config.has_option('GLOBAL', 'breaker_cooldown'):
+            self.config.set("GLOBAL", 'breaker_cooldown', '6h')
+
+        if not self.config.has_option('GLOBAL', 'log_max_size'):
+            self.config.set("GLOBAL", 'log_max_size', '0')
+
+        if not self.config.has_option('GLOBAL', 'log_max_age'):
+            self.config.set("GLOBAL", 'log_max_age', '0s')
+
+        if not self.config.has_option('GLOBAL', 'log_keep'):
+            self.config.set("GLOBAL", 'log_keep', '0')
+
+        if not self.config.has_option('GLOBAL', 'log_compress'):
+            self.config.set("GLOBAL", 'log_compress', 'none')
+
+        if not self.config.has_option('GLOBAL', 'index_file'):
+            self.config.set("GLOBAL", 'index_file', '')
+
+        if not self.config.has_option('GLOBAL', 'nice'):
+            self.config.set("GLOBAL", 'nice', '0')
+
+        if not self.config.has_option('GLOBAL', 'ionice_class'):
+            self.config.set("GLOBAL", 'ionice_class', 'none')
+
+        if not self.config.has_option('GLOBAL', 'ionice_level'):
+            self.config.set("GLOBAL", 'ionice_level', '4')
+
+        if not self.config.has_option('GLOBAL', 'ionice_weight'):
+            self.config.set("GLOBAL", 'ionice_weight', 'False')
+
+        if not self.config.has_option('GLOBAL', 'event_log'):
+            self.config.set("GLOBAL", 'event_log', '')
+
+        # structured events of every sync phase, hooks may subscribe to it
+        try:
+            self.events = EventLog(self.config.get("GLOBAL", "event_log") or None)
+        except IOError as e:
+            raise GlobalError("Failed to open event_log {0}: {1}".format(self.config.get("GLOBAL", "event_log"), e))
+
+        if not self.config.has_option('GLOBAL', 'hook_processes'):
+            self.config.set("GLOBAL", 'hook_processes', '2')
+
+        # pre_command, post_command and manifest run in their own pool, not in sync slots
+        try:
+            if self.config.getint("GLOBAL", "hook_processes") < 1:
+                raise ValueError
+        except ValueError:
+            raise GlobalError("Invalid hook_processes {0}, must be at least 1".format(self.config.get("GLOBAL", "hook_processes")))
+        self.hooks = HookPool(self.config.getint("GLOBAL", "hook_processes"), self.__hook_released)
+
+        # compresses rotated repo logs
+        self.compressor = Compressor()
+        self.compressor.start()
+
+        # name -> status row, rows are replaced rather than modified so
+        # snapshot() can read them without a lock
+        self.__status = dict()
+        self.__status_lock = threading.Lock()
+        # name -> failed syncs in a row
+        self.failures = dict()
+        # name -> probe value of its last successful sync, see last_probe()
+        self.probes = dict()
+        # name -> counters and last values of its syncs, see stats()
+        self.repo_stats = dict()
+        # name -> unix timestamp the repo was queued, while it is queued
+        self.queued_since = dict()
+        # host -> transient failures in a row across its repos
+        self.host_failures = dict()
+        # host -> unix timestamp its repos may sync again
+        self.host_open_until = dict()
+
+        if not self.config.has_option('GLOBAL', 'engine'):
+            self.config.set("GLOBAL", 'engine', 'thread')
+
+        # event engine drives every sync from one thread, thread engine uses a thread per sync
+        if self.config.get("GLOBAL", "engine") == "event":
+            self.supervisor = Supervisor()
+            self.supervisor.start()
+        elif self.config.get("GLOBAL", "engine") == "thread":
+            self.supervisor = None
+        else:
+            raise GlobalError("Unknown engine {0}, must be thread or event".format(self.config.get("GLOBAL", "engine")))
 
         # current running syncs: compared against max set in config
         self.running_syncs = 0
 
+        # single timer thread which re-enqueues sleeping repos
+        self.scheduler = Scheduler(self.__scheduled_enqueue)
+        self.scheduler.start()
+
+        # stops syncs which run too long or stop making progress
+        self.watchdog = Watchdog(self)
+        self.watchdog.start()
+
+        if not self.config.has_option('GLOBAL', 'metrics_port'):
+            self.config.set("GLOBAL", 'metrics_port', '0')
+
+        if not self.config.has_option('GLOBAL', 'metrics_address'):
+            self.config.set("GLOBAL", 'metrics_address', '127.0.0.1')
+
+        # prometheus text format endpoint
+        if self.config.getint("GLOBAL", "metrics_port"):
+            try:
+                self.metrics = MetricsServer(self, self.config.get("GLOBAL", "metrics_address"), self.config.getint("GLOBAL", "metrics_port"))
+            except socket.error as e:
+                raise GlobalError("Failed to listen on metrics_port {0}: {1}".format(self.config.get("GLOBAL", "metrics_port"), e))
+            self.metrics.start()
+        else:
+            self.metrics = None
+
         self.async_thread = threading.Thread(name="async_control", target=self.__check_queue)
         self.async_thread.daemon = True
         self.async_thread.start()
 
     def __check_queue(self):
-        """Queue loop checker for async_control."""
-        while(True):
-            # Check for inactive repos
-            found = None
+        """Queue loop checker for async_control.
 
-            while not found:
-                repo = self.repo_queue.get()[1]
-                if not repo.deactive:
-                    found = True
-                else:
-                    # If inactive, toss aside
-                    break
-
-            if self.running_syncs <= self.config.getint("GLOBAL", "async_processes"):
-                logging.debug("Acquired {0}".format(repo.name))
-                repo.queued = False
+        Blocks until there is both a free slot and a queued repo whose host
+        has a free connection, then dispatches the highest priority one.
+        """
+        while(True):
+            with self.__dispatch:
+                repo = None
+                while not repo:
+                    while not self.repo_queue or self.running_syncs >= self.config.getint("GLOBAL", "async_processes"):
+                        self.__dispatch.wait()
+
+                    repo = self.__next_eligible()
+                    if not repo:
+                        # every queued repo is waiting on a saturated host
+                        self.__dispatch.wait()
+
+                self.stats(repo.name)["last_queue_wait"] = time.time() - self.queued_since.pop(repo.name, time.time())
+                self.emit("dispatch", repo.name, wait=self.stats(repo.name)["last_queue_wait"], queued=len(self.repo_queue))
+                host = source_host(self.config.get(repo.name, "source"))
+                # a sharded repo opens a connection per shard, as many as the host has free
+                connections = self.config.getint(repo.name, "shards")
+                limit = self.host_limit(host)
+                if limit:
+                    connections = min(connections, limit - self.__host_syncs.get(host, 0))
+                self.__host_syncs[host] = self.__host_syncs.get(host, 0) + connections
+                self.__running_hosts[repo.name] = host
+                self.__running_connections[repo.name] = connections
                 self.running_syncs += 1
+                self.__update_status(repo.name, "running", started=time.time(), next_sync=None)
                 logging.debug("Running Sync {0}, {1} slots available".format(repo.name, self.config.getint("GLOBAL", "async_processes")-self.running_syncs))
+
+            try:
                 repo.start_sync()
+            except Exception:
+                logging.exception("Failed to start sync of {0}".format(repo.name))
+                self.__abort_start(repo)
+
+    def __abort_start(self, repo):
+        """Give back what a dispatched repo holds after its sync failed to start.
+
+        The repo counts a failure and waits for its next regular sync.
+
+        :param repo: Repo which was dispatched
+        :type repo: Repo
+        """
+        if repo.pre_ticket is not None:
+            repo.pre_ticket = None
+            self.hooks.release()
+        self.release_slot(repo.name)
+        self.failures[repo.name] = self.failures.get(repo.name, 0) + 1
+        self.__update_status(repo.name, failures=self.failures[repo.name])
+        try:
+            self.schedule_next(repo.name)
+        except Exception:
+            logging.exception("Failed to schedule {0}".format(repo.name))
+
+    def __next_eligible(self):
+        """Pop the highest priority queued repo whose host isn't saturated.
+
+        A repo with a pre_command also waits for a free hook slot, which is
+        reserved for it.
+
+        Deactive repos found along the way are dropped from the queue. Must
+        hold __dispatch.
+
+        :rtype: Repo
+        :returns: Repo to dispatch
+        :rtype: None
+        :returns: None if every queued repo is waiting on its host or a hook slot
+        """
+        skipped = []
+        repo = None
+        while self.repo_queue:
+            entry = heapq.heappop(self.repo_queue)
+            host = source_host(self.config.get(entry[2].name, "source"))
+            if entry[2].deactive:
+                # If inactive, toss aside
+                logging.debug("Dropping {0} from queue, repo is deactive".format(entry[2].name))
+                entry[2].queued = False
+                self.queued_since.pop(entry[2].name, None)
+                self.__update_status(entry[2].name, "deactive")
+            elif self.host_open_until.get(host, 0) > time.time():
+                # host keeps failing, wait for it to cool down
+                logging.debug("Deferring {0}, {1} is paused".format(entry[2].name, host))
+                entry[2].queued = False
+                self.queued_since.pop(entry[2].name, None)
+                self.sleep_until(entry[2].name, self.host_open_until[host])
+            elif not self.host_available(host):
+                skipped.append(entry)
+            elif self.config.get(entry[2].name, "pre_command") and not self.__take_hook(entry[2]):
+                # pre_command would wait for a hook slot while holding the sync slot
+                skipped.append(entry)
             else:
-                logging.debug("Requeuing {0}, no open threads".format(repo.name))
-                self.repo_queue.put([-11, repo])
-                time.sleep(30)
+                repo = entry[2]
+                repo.queued = False
+                break
+
+        for entry in skipped:
+            heapq.heappush(self.repo_queue, entry)
+        return repo
+
+    def __take_hook(self, repo):
+        """Reserve a hook slot for the pre_command of a repo about to be dispatched.
+
+        :param repo: Repo being dispatched
+        :type repo: Repo
+        :rtype: bool
+        :returns: bool whether a slot was free
+        """
+        repo.pre_ticket = self.hooks.try_acquire()
+        return repo.pre_ticket is not None
+
+    def __hook_released(self):
+        """HookPool callback, a repo waiting for a hook slot may be dispatched now."""
+        with self.__dispatch:
+            self.__dispatch.notify()
+
+    def host_limit(self, host):
+        """Max connections to a host.
+
+        :param str host: upstream host, None for local sources
+        :rtype: int
+        :returns: int limit from host_limits or host_connections, 0 if unlimited
+        """
+        if host is None:
+            return 0
+        return self.host_limits.get(host, self.config.getint("GLOBAL", "host_connections"))
+
+    def host_available(self, host):
+        """Bool of whether another sync may connect to a host.
+
+        :param str host: upstream host, None for local sources
+        :rtype: bool
+        """
+        limit = self.host_limit(host)
+        return not limit or self.__host_syncs.get(host, 0) < limit
+
+    def connections(self, name):
+        """Upstream connections the running sync of a repo was given.
+
+        A sharded repo runs at most this many shards.
+
+        :param str name: Name of repo
+        :rtype: int
+        :returns: int connections counted against its host, 1 if not running
+        """
+        with self.__dispatch:
+            return self.__running_connections.get(name, 1)
+
+    def __scheduled_enqueue(self, name):
+        """Scheduler callback, enqueue a repo whose sleep is over."""
+        try:
+            self.enqueue(name)
+        except RepoError as e:
+            logging.info(e.message)
+
+    def schedule_next(self, name, after=None):
+        """Schedule a repo to be enqueued when its next sync is due.
+
+        :param str name: Name of repo
+        :param float after: unix timestamp the last sync finished, default is now
+        :rtype: float
+        :returns: unix timestamp the repo is scheduled for
+        :raises Repo.RepoError: if no repo exists by given name
+        """
+        if not self.get_repo(name):
+            raise RepoError("Repo {0} doesn't exist".format(name), name)
+
+        when = self.get_repo(name).next_sync_time(after)
+        when += random.uniform(0, t2s(self.config.get(name, "sleep_jitter")))
+        self.sleep_until(name, when)
+        return when
+
+    def sleep_until(self, name, when):
+        """Schedule a repo to be enqueued at a given time.
+
+        :param str name: Name of repo
+        :param float when: unix timestamp to enqueue the repo at
+        """
+        self.scheduler.schedule_at(name, when)
+        if self.get_repo(name).deactive:
+            state = "deactive"
+        elif self.failures.get(name):
+            state = "failed"
+        else:
+            state = "sleeping"
+        self.__update_status(name, state, next_sync=when)
+        self.emit("sleep", name, state=state, next_sync=when)
+
+    def schedule_startup(self, name):
+        """Schedule the first sync of a repo after the daemon starts.
+
+        With a state_file the repo is queued at its next due time counted from
+        its last completed sync, or now if that has passed or its last sync
+        failed. Without history async_sleep repos are queued now and
+        hourly_sync repos wait for their next scheduled hour. Repos due now are spread over the GLOBAL
+        startup_window by a stable per repo offset.
+
+        :param str name: Name of repo
+        :raises Repo.RepoError: if repo doesn't exist or is deactive
+        """
+        if not self.get_repo(name):
+            raise RepoError("Repo {0} doesn't exist".format(name), name)
+
+        last = self.state.last(name) if self.state else None
+        done = self.state.last(name, ("success", "partial", "skipped")) if self.state else None
+        if last and last["outcome"] in ("transient", "fatal"):
+            # failed before the restart, try again now rather than a full interval later
+            when = None
+        elif done:
+            when = self.get_repo(name).next_sync_time(done["finish"])
+        elif self.get_repo(name).hourly:
+            when = self.get_repo(name).next_sync_time()
+        else:
+            when = None
+
+        now = time.time()
+        if when is None or when <= now:
+            # spread repos due now over the startup window
+            when = now + stable_offset(name, t2s(self.config.get("GLOBAL", "startup_window")))
+
+        if when <= now:
+            self.enqueue(name)
+        else:
+            logging.info("{0} next sync at {1}".format(name, datetime.fromtimestamp(int(when))))
+            self.sleep_until(name, when)
+
+    def emit(self, event, name, **fields):
+        """Emit an event about a repo, adding its weight and the slots in use.
+
+        :param str event: Name of the event
+        :param str name: Name of repo
+        :param fields: values carried by the event
+        """
+        fields.setdefault("exit_code", None)
+        weight = self.config.getint(name, "weight") if self.config.has_option(name, "weight") else None
+        self.events.emit(event, name, weight=weight, slots=self.running_syncs,
+                         async_processes=self.config.getint("GLOBAL", "async_processes"), **fields)
+
+    def record_sync(self, job):
+        """Record a finished sync in repo_stats and the state_file.
+
+        :param job: Sync which just finished
+        :type job: Repo.rsync_job
+        """
+        if not job.start_time:
+            return
+
+        duration = (job.finish_time - job.start_time).total_seconds()
+        if job.outcome in ("success", "partial"):
+            self.update_duration(job.name, duration)
+
+        transferred = None
+        if job.progress and job.progress.last_update:
+            transferred = job.progress.bytes_received or job.progress.bytes_transferred
+
+        stats = self.stats(job.name)
+        stats["syncs"] += 1
+        stats["last_duration"] = duration
+        stats["bytes"] += transferred or 0
+        stats["last_bytes"] = transferred
+        stats["last_finish"] = time.mktime(job.finish_time.timetuple())
+        if job.outcome in ("success", "partial", "skipped"):
+            stats["last_success"] = time.mktime(job.finish_time.timetuple())
+        if job.outcome == "skipped":
+            stats["skips"] += 1
+        elif job.outcome in ("transient", "fatal"):
+            stats["failures"] += 1
+
+        if self.config.get(job.name, "index_file"):
+            write_index(self.config.get(job.name, "index_file"), job.name, job.start_time, job.finish_time,
+                        job.outcome, job.returncode, transferred, self.config.get(job.name, "log_file"))
+
+        if not self.state:
+            return
+
+        self.state.record(job.name,
+                          time.mktime(job.start_time.timetuple()),
+                          time.mktime(job.finish_time.timetuple()),
+                          job.returncode,
+                          transferred,
+                          job.outcome)
+
+    def stats(self, name):
+        """Counters and last values of the syncs of a repo.
+
+        :param str name: Name of repo
+        :rtype: dict
+        :returns: dict of syncs, failures, skips, bytes, last_bytes, last_duration, last_finish, last_success and last_queue_wait
+        """
+        if name not in self.repo_stats:
+            self.repo_stats[name] = {"syncs": 0, "failures": 0, "skips": 0, "bytes": 0, "last_bytes": None, "last_duration": None,
+                                     "last_finish": None, "last_success": None, "last_queue_wait": None}
+        return self.repo_stats[name]
+
+    def finish_sync(self, job):
+        """Record the result of a finished sync and schedule the next one.
+
+        Transient failures are retried with capped exponential backoff.
+        Partial transfers and syncs terminated by hand wait for the next
+        regular sync, as do fatal failures since retrying won't help. After
+        breaker_threshold failures in a row the repo waits breaker_cooldown,
+        and after as many transient failures in a row across the repos of a
+        host, every repo of that host waits breaker_cooldown.
+
+        Config changes held back while the sync ran are applied before the
+        next sync is scheduled, and a repo removed meanwhile is deleted.
+
+        :param job: Sync which just finished
+        :type job: Repo.rsync_job
+        :rtype: float
+        :returns: unix timestamp of the next sync
+        :rtype: None
+        :returns: None if the repo was removed
+        """
+        host = source_host(self.config.get(job.name, "source"))
+        if job.requeue:
+            # stopped by the watchdog
+            job.outcome = "transient"
+        elif job.terminated:
+            job.outcome = "stopped"
+        elif job.skipped:
+            job.outcome = "skipped"
+        else:
+            job.outcome = classify_exit(job.returncode)
+        self.record_sync(job)
+        if job.start_time:
+            self.emit("finish", job.name, outcome=job.outcome, exit_code=job.returncode,
+                      start=time.mktime(job.start_time.timetuple()) + job.start_time.microsecond / 1e6, duration=(job.finish_time - job.start_time).total_seconds())
+
+        # the probe file as of a complete sync, later syncs are skipped while it is unchanged
+        if job.outcome == "success" and job.probe_value:
+            self.probes[job.name] = job.probe_value
+            if self.state:
+                self.state.set_probe(job.name, job.probe_value)
+
+        threshold = self.config.getint("GLOBAL", "breaker_threshold")
+        cooldown = t2s(self.config.get("GLOBAL", "breaker_cooldown"))
+
+        if job.outcome in ("success", "partial", "skipped"):
+            self.failures.pop(job.name, None)
+            self.host_failures.pop(host, None)
+        elif job.outcome in ("transient", "fatal"):
+            self.failures[job.name] = self.failures.get(job.name, 0) + 1
+            if job.outcome == "transient" and host:
+                self.host_failures[host] = self.host_failures.get(host, 0) + 1
+                if threshold and self.host_failures[host] >= threshold:
+                    logging.warning("{0} failed {1} times in a row, pausing its repos for {2}".format(host, self.host_failures[host], self.config.get("GLOBAL", "breaker_cooldown")))
+                    self.host_open_until[host] = time.time() + cooldown
+                    self.host_failures.pop(host)
+
+        if self.__apply_pending(job.name):
+            return None
+
+        failures = self.failures.get(job.name, 0)
+        stats = self.stats(job.name)
+        self.__update_status(job.name, last_outcome=job.outcome, last_exit=job.returncode, failures=failures,
+                             last_duration=stats["last_duration"], last_success=stats["last_success"],
+                             last_bytes=stats["last_bytes"], bytes=stats["bytes"])
+        if not failures:
+            return self.schedule_next(job.name)
+
+        logging.warning("{0} sync {1} with exit code {2}, {3} failures in a row".format(job.name, job.outcome, job.returncode, failures))
+        if threshold and failures >= threshold:
+            logging.warning("Pausing {0} for {1}".format(job.name, self.config.get("GLOBAL", "breaker_cooldown")))
+            when = time.time() + cooldown
+        elif job.outcome == "transient":
+            retry = time.time() + backoff(failures, t2s(self.config.get("GLOBAL", "retry_base")), t2s(self.config.get("GLOBAL", "retry_max")))
+            when = min(retry, self.get_repo(job.name).next_sync_time())
+        else:
+            return self.schedule_next(job.name)
+
+        self.sleep_until(job.name, when)
+        return when
+
+    def last_probe(self, name):
+        """Probe value of the last successful sync of a repo.
+
+        :param str name: Name of repo
+        :rtype: str
+        :returns: str digest of the probe file
+        :rtype: None
+        :returns: None if the repo hasn't synced with a probe
+        """
+        if name not in self.probes and self.state:
+            self.probes[name] = self.state.probe(name)
+        return self.probes.get(name)
+
+    def expected_duration(self, name):
+        """Estimated duration of the next sync of a repo.
+
+        :param str name: Name of repo
+        :rtype: float
+        :returns: float seconds
+        :rtype: None
+        :returns: None if the repo has no successful syncs recorded
+        """
+        return self.durations.get(name)
+
+    def update_duration(self, name, seconds):
+        """Fold a successful sync duration into the estimate of a repo.
+
+        The estimate is an exponential moving average weighting the newest
+        sync by 0.3.
+
+        :param str name: Name of repo
+        :param float seconds: duration of the sync
+        """
+        if name in self.durations:
+            self.durations[name] = 0.7 * self.durations[name] + 0.3 * seconds
+        else:
+            self.durations[name] = seconds
+
+    def release_slot(self, name):
+        """Free the sync slot and host connection of a repo and wake the dispatcher.
+
+        The repo is finishing until its hooks are done.
+
+        :param str name: Name of repo whose sync finished
+        """
+        with self.__dispatch:
+            host = self.__running_hosts.pop(name, None)
+            connections = self.__running_connections.pop(name, 1)
+            if host in self.__host_syncs:
+                self.__host_syncs[host] -= connections
+            self.running_syncs -= 1
+            self.__dispatch.notify()
+        if self.__status.get(name, {}).get("state") == "running":
+            self.__update_status(name, "finishing")
+
+    def allocate_bandwidth(self, job):
+        """Return the --bwlimit for a starting rsync.
+
+        The first call for a job adds it to the running set and splits
+        total_bandwidth again. Jobs left above their new share are throttled.
+
+        :param job: Sync about to start rsync
+        :type job: Repo.rsync_job
+        :rtype: int
+        :returns: int limit in KiB/s, 0 if total_bandwidth is unlimited
+        """
+        if not self.config.getint("GLOBAL", "total_bandwidth"):
+            return 0
+
+        with self.__bandwidth_lock:
+            if job not in self.__bandwidth:
+                self.__bandwidth[job] = None
+                self.__rebalance_bandwidth()
+            return self.__bandwidth[job]
+
+    def free_bandwidth(self, job):
+        """Remove a finished rsync from the bandwidth split.
+
+        :param job: Sync whose rsync finished
+        :type job: Repo.rsync_job
+        """
+        with self.__bandwidth_lock:
+            if self.__bandwidth.pop(job, None) is not None:
+                self.__rebalance_bandwidth(leaving=job.name)
+
+    def __rebalance_bandwidth(self, leaving=None):
+        """Split total_bandwidth across running syncs by weight.
+
+        Lower weights get a larger share. Syncs dispatched but not yet at
+        rsync count towards the split, so a burst of starts shrinks the others
+        once. A new rsync takes what is left of the total, settling for as
+        little as its share divided by bandwidth_regrow; only when less is left
+        are the rsyncs furthest above their share restarted at it, and only as
+        many as needed. A running rsync is restarted for a larger share once
+        its share has grown to at least bandwidth_regrow times its limit and
+        the total has room for it. Must hold __bandwidth_lock.
+
+        :param str leaving: Name of a sync whose rsync finished but which still holds its slot
+        """
+        total = self.config.getint("GLOBAL", "total_bandwidth")
+        regrow = self.config.getfloat("GLOBAL", "bandwidth_regrow")
+
+        with self.__dispatch:
+            running = [name for name in self.__running_hosts if name != leaving]
+        starting = [name for name in running if name not in [job.name for job in self.__bandwidth] and self.config.has_section(name)]
+
+        weights = dict((job, max(11 - self.config.getint(job.name, "weight"), 1)) for job in self.__bandwidth)
+        reserved = sum(max(11 - self.config.getint(name, "weight"), 1) for name in starting)
+        total_shares = sum(weights.values()) + reserved
+        shares = dict((job, max(total * weights[job] // total_shares, 1)) for job in weights)
+        spare = total - total * reserved // total_shares - sum(limit for limit in self.__bandwidth.values() if limit)
+
+        def change(job, limit):
+            logging.debug("Bandwidth of {0} changed from {1} to {2}".format(job.name, self.__bandwidth[job], limit))
+            self.__bandwidth[job] = limit
+            job.throttle()
+
+        for job in [job for job, limit in self.__bandwidth.items() if limit is None]:
+            need = shares[job] / regrow if regrow > 1 else shares[job]
+            # take back bandwidth from the rsyncs furthest above their share first
+            for other in sorted(self.__bandwidth, key=lambda other: (self.__bandwidth[other] or 0) - shares[other], reverse=True):
+                if spare >= need or not self.__bandwidth[other] or self.__bandwidth[other] <= shares[other]:
+                    break
+                spare += self.__bandwidth[other] - shares[other]
+                change(other, shares[other])
+            self.__bandwidth[job] = max(min(shares[job], spare), 1)
+            spare -= self.__bandwidth[job]
+
+        if not regrow:
+            return
+        for job, limit in self.__bandwidth.items():
+            grown = min(shares[job], limit + max(spare, 0))
+            if grown >= limit * regrow:
+                spare -= grown - limit
+                change(job, grown)
 
     def get_repo(self, name):
         """Return repo object if exists.
@@ -321,8 +1679,9 @@ class RepoManager(object):
         :rtype: Repo
         :returns: Repo Object
         """
-        for name in self._repo_dict:
-            yield self._repo_dict[name]
+        # iterate over a copy so repos may be added or removed meanwhile
+        for repo in self._repo_dict.values():
+            yield repo
 
     def add_repo(self, name):
         """Create a repo for a section in the running config.
@@ -336,6 +1695,14 @@ class RepoManager(object):
         if self.config.has_section(name):
             repo = Repo(name, self.config)
             self._repo_dict[name] = repo
+            self.__update_status(name, "deactive" if repo.deactive else "idle", deactive=repo.deactive,
+                                 weight=self.config.getint(name, "weight"), host=source_host(self.config.get(name, "source")))
+
+            # seed the duration estimate from history, oldest first
+            if self.state:
+                for sync in reversed(self.state.history(name, 10)):
+                    if sync["exit_code"] == 0 and sync["duration"] is not None:
+                        self.update_duration(name, sync["duration"])
         else:
             raise RepoConfigError("Cannot create repo, section {0} does not exist".format(name), name)
 
@@ -350,6 +1717,10 @@ class RepoManager(object):
                 # nothing to do, already deactive
                 return
             self.get_repo(name).deactive = True
+            if self.__status[name]["state"] in ("running", "finishing"):
+                self.__update_status(name, deactive=True)
+            else:
+                self.__update_status(name, "deactive", deactive=True)
             logging.info("Deactivating {0}".format(name))
         else:
             raise RepoError("No Repo Named {0}".format(name), name)
@@ -357,6 +1728,9 @@ class RepoManager(object):
     def activate(self, name):
         """Activate repo for syncing.
 
+        A repo deactivated during its sync keeps syncing and is scheduled once
+        it finishes.
+
         :param str name: Name of Repo
         :raises Repo.RepoError: if no repo exists by given name
         """
@@ -365,11 +1739,53 @@ class RepoManager(object):
                 # nothing to do, already active
                 return
             self.get_repo(name).deactive = False
-            self.enqueue(name)
+            if self.__status[name]["state"] in ("running", "finishing"):
+                # finish_sync schedules it
+                self.__update_status(name, deactive=False)
+            else:
+                self.__update_status(name, "idle", deactive=False)
+                self.enqueue(name)
             logging.info("Activating {0}".format(name))
         else:
             raise RepoError("No Repo Named {0}".format(name), name)
 
+    def __update_status(self, name, state=None, **columns):
+        """Replace the status row of a repo with updated columns.
+
+        :param str name: Name of repo
+        :param str state: New state of the repo, also resets since
+        :param columns: Other columns to change
+        """
+        with self.__status_lock:
+            if name in self.__status:
+                row = dict(self.__status[name])
+            else:
+                row = dict.fromkeys(self.status_columns)
+                row.update(name=name, failures=0, bytes=0, deactive=False)
+            if state:
+                row["state"] = state
+                row["since"] = time.time()
+            row.update(columns)
+            self.__status[name] = row
+
+    def snapshot(self, sort="name", reverse=False):
+        """Status rows of every repo.
+
+        Rows are kept up to date as repos change state (idle, queued, running,
+        sleeping, failed, deactive), so taking a snapshot neither locks the
+        dispatcher nor computes anything per repo. Times are unix timestamps.
+
+        :param str sort: Column to sort rows by, one of status_columns
+        :param bool reverse: Sort descending
+        :rtype: list
+        :returns: list of dicts keyed by status_columns
+        :raises ValueError: if sort isn't a column
+        """
+        if sort not in self.status_columns:
+            raise ValueError("Unknown column {0}".format(sort))
+        rows = [dict(row) for row in self.__status.values()]
+        return sorted(rows, key=lambda row: row[sort], reverse=reverse)
+
     def status(self, name):
         """Return status of Repo.
 
@@ -377,17 +1793,41 @@ class RepoManager(object):
         :rtype: str
         :returns: str status of Repo
         """
-        if not self.get_repo(name):
+        row = self.__status.get(name)
+        if not row:
             raise RepoError("Repo {0} doesn't exist".format(name), name)
 
-        if self.get_repo(name).deactive:
+        now = time.time()
+        if row["deactive"]:
             return "{0} is deactive".format(name)
-        elif self.get_repo(name).queued:
+        elif row["state"] == "queued":
             return "{0} is queued".format(name)
-        elif self.get_repo(name).is_alive():
-            return "{0} is syncing, active for {1}".format(name, self.get_repo(name).running_time())
+        elif row["state"] == "idle":
+            return "{0} is idle".format(name)
+        elif row["state"] == "running":
+            running = timedelta(seconds=int(now - row["started"]))
+            progress = self.get_repo(name).progress()
+            if progress and progress.last_update:
+                return "{0} is syncing, active for {1}, {2}% done, {3} at {4}/s, {5}/{6} files checked, eta {7}".format(
+                    name, running, progress.percent, b2h(progress.bytes_transferred),
+                    b2h(progress.rate or 0), progress.files_checked, progress.files_total or "?", timedelta(seconds=progress.eta or 0))
+            shards = self.get_repo(name).shards()
+            if shards:
+                return "{0} is syncing, active for {1}, {2}/{3} shards done".format(name, running, shards[0], shards[1])
+            return "{0} is syncing, active for {1}".format(name, running)
+        elif row["state"] == "finishing":
+            return "{0} is running hooks, active for {1}".format(name, timedelta(seconds=int(now - row["started"])))
         else:
-            return "{0} is sleeping, sync in {1}".format(name, self.get_repo(name).time_remaining())
+            status = "{0} is sleeping, sync in {1}".format(name, timedelta(seconds=int(max(row["next_sync"] - now, 0))))
+            if row["last_outcome"] == "skipped":
+                status += ", last sync skipped, unchanged upstream"
+            elif row["last_outcome"]:
+                status += ", last sync {0} (exit {1})".format(row["last_outcome"], row["last_exit"])
+            if row["failures"]:
+                status += ", {0} failures in a row".format(row["failures"])
+            if row["last_bytes"] is not None:
+                status += ", last sync transferred {0}".format(b2h(row["last_bytes"]))
+            return status
 
     def del_repo(self, name):
         """Delete repo object from dict.
@@ -396,9 +1836,270 @@ class RepoManager(object):
         :raises Repo.RepoError: if no repo exists by passed in name.
         """
         if self.get_repo(name):
+            self.scheduler.cancel(name)
             del self._repo_dict[name]
+            with self.__status_lock:
+                self.__status.pop(name, None)
         else:
-            raise RepoError("Cannot delete repo, repo {0} does not exist".format(name))
+            raise RepoError("Cannot delete repo, repo {0} does not exist".format(name), name)
+
+    def load_repo(self, name, options=None):
+        """Create a repo and schedule its first sync.
+
+        :param str name: Name of repo
+        :param dict options: raw option values of its section, default is the section in the running config
+        :raises Repo.RepoConfigError: if the section is invalid or the repo already exists
+        """
+        if self.get_repo(name):
+            raise RepoConfigError("Cannot create repo {0}, already created".format(name), name)
+        if options is not None:
+            replace_section(self.config, name, options)
+        self.add_repo(name)
+        try:
+            self.schedule_startup(name)
+        except RepoError as e:
+            logging.info(e.message)
+
+    def configure_repo(self, name, options):
+        """Replace the config section of a repo.
+
+        A repo which is syncing keeps its settings until the sync is done, the
+        new ones are applied before its next sync is scheduled. Otherwise they
+        apply now, and a sleeping repo whose schedule changed is rescheduled
+        from its last sync.
+
+        :param str name: Name of repo
+        :param dict options: raw option values of the new section
+        :rtype: bool
+        :returns: bool whether the options were applied now rather than held back
+        :raises Repo.RepoError: if no repo exists by given name or it is being removed
+        :raises Repo.RepoConfigError: if the new section is invalid, the old one is kept
+        """
+        repo = self.get_repo(name)
+        if not repo:
+            raise RepoError("No Repo Named {0}".format(name), name)
+
+        with self.__dispatch:
+            if name in self.__removing:
+                raise RepoError("Repo {0} is being removed".format(name), name)
+            if repo.is_alive() or self.__status[name]["state"] in ("running", "finishing"):
+                self.__pending[name] = options
+                logging.info("{0} is syncing, applying its new config once the sync is done".format(name))
+                return False
+            self.__configure_repo(name, options)
+        return True
+
+    def __configure_repo(self, name, options):
+        """Apply a new config section to a repo which isn't syncing.
+
+        Called with __dispatch held, so the repo can't be dispatched meanwhile.
+
+        :param str name: Name of repo
+        :param dict options: raw option values of the new section
+        :raises Repo.RepoConfigError: if the new section is invalid, the old one is kept
+        """
+        repo = self.get_repo(name)
+        old = dict(self.config.items(name, raw=True))
+        was_deactive = self.config.getboolean(name, "deactive")
+        repo.reconfigure(options)
+        new = dict(self.config.items(name, raw=True))
+        self.__update_status(name, weight=self.config.getint(name, "weight"), host=source_host(self.config.get(name, "source")))
+        self.emit("configure", name, changed=sorted(option for option in set(old) | set(new) if old.get(option) != new.get(option)))
+        logging.info("Reconfigured {0}".format(name))
+
+        # finish_sync schedules a repo whose sync just ended
+        idle = self.__status[name]["state"] not in ("running", "finishing")
+        deactive = self.config.getboolean(name, "deactive")
+        if deactive and not was_deactive:
+            self.deactivate(name)
+        elif was_deactive and not deactive:
+            if idle:
+                try:
+                    self.activate(name)
+                except RepoError as e:
+                    logging.info(e.message)
+            else:
+                repo.deactive = False
+                self.__update_status(name, deactive=False)
+        elif idle and self.__status[name]["state"] == "sleeping" and \
+                any(old.get(option) != new.get(option) for option in ("async_sleep", "hourly_sync", "sleep_jitter")):
+            self.schedule_next(name, self.stats(name)["last_finish"])
+
+    def remove_repo(self, name, terminate=False):
+        """Delete a repo and its section from the running config.
+
+        A queued repo is taken off the queue. A syncing repo is deactivated
+        and deleted once its sync is done, after terminating it if asked to.
+
+        :param str name: Name of repo
+        :param bool terminate: terminate a running sync rather than let it finish
+        :rtype: bool
+        :returns: bool whether the repo was deleted now rather than left to finish its sync
+        :raises Repo.RepoError: if no repo or section exists by given name
+        """
+        repo = self.get_repo(name)
+        if not repo:
+            # section which failed to load
+            if name != "GLOBAL" and self.config.has_section(name):
+                self.config.remove_section(name)
+                return True
+            raise RepoError("No Repo Named {0}".format(name), name)
+
+        self.scheduler.cancel(name)
+        with self.__dispatch:
+            if repo.queued:
+                self.repo_queue[:] = [entry for entry in self.repo_queue if entry[2] is not repo]
+                heapq.heapify(self.repo_queue)
+                repo.queued = False
+                self.queued_since.pop(name, None)
+            if not repo.is_alive() and self.__status[name]["state"] not in ("running", "finishing"):
+                self.__delete_repo(name)
+                return True
+            self.__removing.add(name)
+            self.__pending.pop(name, None)
+            self.deactivate(name)
+
+        logging.info("Removing {0} once its sync is done".format(name))
+        if terminate:
+            repo.terminate()
+        return False
+
+    def __delete_repo(self, name):
+        """Delete a repo which isn't syncing, its section and what is kept about it in memory.
+
+        :param str name: Name of repo
+        """
+        self.emit("remove", name)
+        self.del_repo(name)
+        self.config.remove_section(name)
+        for kept in (self.failures, self.probes, self.repo_stats, self.durations):
+            kept.pop(name, None)
+        logging.info("Removed {0}".format(name))
+
+    def __apply_pending(self, name):
+        """Apply a change held back while a repo was syncing.
+
+        :param str name: Name of repo whose sync is done
+        :rtype: bool
+        :returns: bool whether the repo was removed
+        """
+        with self.__dispatch:
+            if name in self.__removing:
+                self.__removing.discard(name)
+                self.__delete_repo(name)
+                return True
+            options = self.__pending.pop(name, None)
+            if options is not None:
+                try:
+                    self.__configure_repo(name, options)
+                except RepoConfigError as e:
+                    logging.warning("Failed to reconfigure {0} | {1}".format(name, e.message))
+                except Exception:
+                    # the sync still has to be scheduled
+                    logging.exception("Failed to reconfigure {0}".format(name))
+        return False
+
+    def reload(self, name=None):
+        """Apply the changes made to config_file since it was last read.
+
+        The file is read again and compared with what was loaded, section by
+        section. New repos are added and scheduled, removed repos are drained
+        or terminated as set by the GLOBAL reload_removed, and changed repos
+        are reconfigured, a running sync keeping its settings until it is
+        done. Unchanged repos aren't touched. Changed GLOBAL options are
+        applied except restart_options, and repos which default to a changed
+        GLOBAL option are reconfigured.
+
+        :param str name: Only reload this section, None for the whole file
+        :rtype: dict
+        :returns: dict of added, removed, changed and failed lists of repo names
+        :raises GlobalError: if config_file can't be read or has no GLOBAL section
+        """
+        if not self.config_file:
+            raise GlobalError("No config file to reload")
+        try:
+            sections = read_sections(self.config_file)
+        except (IOError, ConfigParser.Error) as e:
+            raise GlobalError("Failed to read {0}: {1}".format(self.config_file, e))
+        if "GLOBAL" not in sections:
+            raise GlobalError("Config requires GLOBAL Section")
+
+        result = {"added": [], "removed": [], "changed": [], "failed": []}
+        with self.__reload_lock:
+            inherited = set()
+            if name in (None, "GLOBAL"):
+                inherited = self.__reload_global(sections["GLOBAL"])
+            if name is None:
+                names = sorted((set(self.__loaded) | set(sections)) - set(["GLOBAL"]))
+            elif name == "GLOBAL":
+                # repos keep their loaded sections, only the GLOBAL defaults changed
+                names = sorted(set(self.__loaded) - set(["GLOBAL"]))
+                sections = self.__loaded
+            else:
+                names = [name]
+
+            for section in names:
+                old = self.__loaded.get(section)
+                options = sections.get(section)
+                try:
+                    if options is None:
+                        if not self.get_repo(section) and not self.config.has_section(section):
+                            raise RepoError("No section {0} in {1}".format(section, self.config_file), section)
+                        self.remove_repo(section, self.config.get("GLOBAL", "reload_removed") == "terminate")
+                        result["removed"].append(section)
+                    elif not self.get_repo(section):
+                        self.load_repo(section, options)
+                        result["added"].append(section)
+                    elif options != old or inherited - set(options):
+                        self.configure_repo(section, options)
+                        result["changed"].append(section)
+                except (RepoConfigError, RepoError) as e:
+                    logging.warning("Failed to reload {0} | {1}".format(section, e.message))
+                    result["failed"].append(section)
+                    continue
+                if options is None:
+                    self.__loaded.pop(section, None)
+                else:
+                    self.__loaded[section] = options
+
+            with self.__dispatch:
+                # slots or host connections may have been added
+                self.__dispatch.notify_all()
+
+        logging.info("Reloaded {0}: {1} added, {2} removed, {3} changed, {4} failed".format(
+            name or self.config_file, len(result["added"]), len(result["removed"]), len(result["changed"]), len(result["failed"])))
+        return result
+
+    def __reload_global(self, options):
+        """Apply the changed options of a reloaded GLOBAL section.
+
+        :param dict options: raw option values of the GLOBAL section
+        :rtype: set
+        :returns: set of the inherited_options which changed
+        """
+        old = self.__loaded.get("GLOBAL", {})
+        changed = set()
+        for option in sorted(set(old) | set(options)):
+            if old.get(option) == options.get(option):
+                continue
+            if option in self.restart_options or option not in options:
+                logging.warning("GLOBAL {0} changed, restart to apply it".format(option))
+                continue
+            try:
+                self.global_checks.get(option, str)(options[option])
+            except (ValueError, KeyError, IndexError):
+                logging.warning("Invalid GLOBAL {0} {1}, keeping {2}".format(option, options[option], self.config.get("GLOBAL", option)))
+                continue
+            if option in self.global_choices and options[option] not in self.global_choices[option]:
+                logging.warning("Unknown GLOBAL {0} {1}, must be one of {2}".format(option, options[option], ", ".join(self.global_choices[option])))
+                continue
+            if option == "host_limits":
+                self.host_limits = parse_limits(options[option])
+            self.config.set("GLOBAL", option, options[option])
+            changed.add(option)
+            logging.info("GLOBAL {0} set to {1}".format(option, options[option]))
+        self.__loaded["GLOBAL"] = options
+        return changed & set(self.inherited_options)
 
     def enqueue(self, name):
         """Add repo to the queue.
@@ -415,11 +2116,19 @@ class RepoManager(object):
         if self.get_repo(name).queued:
             raise RepoError("Failed to queue repo, {0} already queued.".format(name), name)
 
-        if self.get_repo(name).is_alive():
+        if self.get_repo(name).is_alive() or self.__status[name]["state"] in ("running", "finishing"):
             raise RepoError("Failed to queue Repo, {0} is syncing.".format(name), name)
 
-        self.repo_queue.put([self.config.get(name, "weight"), self.get_repo(name)])
-        self.get_repo(name).queued = True
+        # a manual enqueue replaces the pending timer
+        self.scheduler.cancel(name)
+
+        with self.__dispatch:
+            heapq.heappush(self.repo_queue, [self.policy.key(self.get_repo(name)), next(self.__counter), self.get_repo(name)])
+            self.get_repo(name).queued = True
+            self.queued_since[name] = time.time()
+            self.__update_status(name, "queued", next_sync=None)
+            self.emit("enqueue", name, queued=len(self.repo_queue))
+            self.__dispatch.notify()
 
 
 class GlobalError(Exception):
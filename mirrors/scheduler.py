@@ -0,0 +1,115 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class Scheduler(threading.Thread):
+    def __init__(self, callback):
+        """Single thread which fires a callback for each repo at its deadline.
+
+        Deadlines are kept in a min-heap, so one thread serves every sleeping
+        repo no matter how many there are.
+
+        :param callback: called with the repo name once its deadline passes
+        :type callback: function
+        """
+        threading.Thread.__init__(self, name="scheduler")
+        self.daemon = True
+        self.callback = callback
+
+        # heap of (deadline, count, name); stale entries are skipped lazily
+        self.__heap = []
+        # current deadline of every scheduled repo
+        self.__deadlines = dict()
+        self.__counter = itertools.count()
+        self.__cond = threading.Condition()
+
+    def schedule(self, name, delay):
+        """Schedule a repo to fire after a delay.
+
+        Replaces any deadline already set for the repo.
+
+        :param str name: Name of repo
+        :param float delay: seconds from now
+        """
+        self.schedule_at(name, time.time() + delay)
+
+    def schedule_at(self, name, when):
+        """Schedule a repo to fire at an absolute time.
+
+        Replaces any deadline already set for the repo.
+
+        :param str name: Name of repo
+        :param float when: unix timestamp of the deadline
+        """
+        with self.__cond:
+            self.__deadlines[name] = when
+            heapq.heappush(self.__heap, (when, next(self.__counter), name))
+            self.__cond.notify()
+
+    def cancel(self, name):
+        """Remove the deadline of a repo.
+
+        :param str name: Name of repo
+        :rtype: bool
+        :returns: True if the repo had a deadline
+        """
+        with self.__cond:
+            return self.__deadlines.pop(name, None) is not None
+
+    def deadline(self, name):
+        """Return the deadline of a repo.
+
+        :param str name: Name of repo
+        :rtype: float
+        :returns: unix timestamp of the deadline
+        :rtype: None
+        :returns: None if repo is not scheduled
+        """
+        with self.__cond:
+            return self.__deadlines.get(name)
+
+    def time_remaining(self, name):
+        """Return seconds left until a repo fires.
+
+        :param str name: Name of repo
+        :rtype: float
+        :returns: seconds until the deadline, never negative
+        :rtype: None
+        :returns: None if repo is not scheduled
+        """
+        when = self.deadline(name)
+        if when is not None:
+            return max(when - time.time(), 0)
+
+    def __len__(self):
+        with self.__cond:
+            return len(self.__deadlines)
+
+    def run(self):
+        while(True):
+            with self.__cond:
+                while(True):
+                    # drop entries which were cancelled or rescheduled
+                    while self.__heap and self.__deadlines.get(self.__heap[0][2]) != self.__heap[0][0]:
+                        heapq.heappop(self.__heap)
+
+                    if not self.__heap:
+                        self.__cond.wait()
+                        continue
+
+                    delay = self.__heap[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self.__cond.wait(delay)
+
+                name = heapq.heappop(self.__heap)[2]
+                del self.__deadlines[name]
+
+            logging.debug("Scheduler firing {0}".format(name))
+            try:
+                self.callback(name)
+            except Exception:
+                logging.exception("Scheduler callback failed for {0}".format(name))
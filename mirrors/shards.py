@@ -0,0 +1,89 @@
+from mirrors.libmirrors import worst_exit
+
+
+def parse_listing(output):
+    """Top level directories of an rsync --list-only listing.
+
+    :param str output: output of rsync --list-only source/
+    :rtype: list
+    :returns: sorted list of directory names
+    """
+    names = []
+    for line in output.splitlines():
+        fields = line.split(None, 4)
+        if len(fields) < 5 or not fields[0].startswith("d"):
+            continue
+        if fields[4] not in (".", ".."):
+            names.append(fields[4])
+    return sorted(names)
+
+
+def split_shards(names, shards):
+    """Split directories into shards of about the same count.
+
+    :param list names: sorted directory names
+    :param int shards: Number of shards
+    :rtype: list
+    :returns: list of non empty lists of names
+    """
+    groups = [names[i::shards] for i in range(shards)]
+    return [group for group in groups if group]
+
+
+class ProcessGroup(object):
+    def __init__(self, procs):
+        """Parallel processes waited on as one.
+
+        Behaves like the subprocess.Popen of a single process, so the engines
+        and the watchdog handle a sharded sync like any other.
+
+        :param list procs: subprocess.Popen of each worker
+        """
+        self.procs = procs
+        self.stdout = None
+        self.returncode = None
+
+    def done(self):
+        """Number of workers which have exited.
+
+        :rtype: int
+        """
+        return len([proc for proc in self.procs if proc.poll() is not None])
+
+    def poll(self):
+        """Check whether every worker has exited.
+
+        :rtype: int
+        :returns: int most severe exit code of the workers
+        :rtype: None
+        :returns: None while any worker is running
+        """
+        if self.done() < len(self.procs):
+            return None
+        self.returncode = worst_exit([proc.returncode for proc in self.procs])
+        return self.returncode
+
+    def wait(self):
+        """Wait for every worker to exit.
+
+        :rtype: int
+        :returns: int most severe exit code of the workers
+        """
+        for proc in self.procs:
+            proc.wait()
+        return self.poll()
+
+    def send_signal(self, signum):
+        """Send a signal to every running worker.
+
+        :param int signum: Signal to send
+        """
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.send_signal(signum)
+
+    def terminate(self):
+        """Send SIGTERM to every running worker."""
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.terminate()
@@ -0,0 +1,114 @@
+import logging
+import os
+import time
+from datetime import datetime
+
+# name of a snapshot, the time it was published
+SNAPSHOT_FORMAT = "%Y%m%d-%H%M%S"
+
+
+def snapshot_dir(destination):
+    """Directory holding the snapshots of a repo.
+
+    :param str destination: repo destination
+    :rtype: str
+    """
+    return os.path.join(destination, "snapshots")
+
+
+def staging_path(destination):
+    """Directory the next snapshot is synced into.
+
+    A staging directory left by a failed sync is reused, so the next sync
+    picks up where it stopped.
+
+    :param str destination: repo destination
+    :rtype: str
+    """
+    return os.path.join(snapshot_dir(destination), ".staging")
+
+
+def current_path(destination):
+    """Symlink to the published snapshot, the directory to serve.
+
+    :param str destination: repo destination
+    :rtype: str
+    """
+    return os.path.join(destination, "current")
+
+
+def current_snapshot(destination):
+    """Absolute path of the published snapshot.
+
+    :param str destination: repo destination
+    :rtype: str
+    :returns: str path the current symlink points to
+    :rtype: None
+    :returns: None if nothing has been published
+    """
+    current = current_path(destination)
+    if os.path.islink(current) and os.path.isdir(current):
+        return os.path.realpath(current)
+
+
+def snapshots(destination):
+    """Published snapshots of a repo, oldest first.
+
+    :param str destination: repo destination
+    :rtype: list
+    :returns: list of absolute snapshot paths
+    """
+    directory = snapshot_dir(destination)
+    if not os.path.isdir(directory):
+        return []
+    found = []
+    for entry in os.listdir(directory):
+        try:
+            datetime.strptime(entry, SNAPSHOT_FORMAT)
+        except ValueError:
+            continue
+        found.append(os.path.realpath(os.path.join(directory, entry)))
+    return sorted(found)
+
+
+def publish(destination, now=None):
+    """Publish the staging directory as the current snapshot.
+
+    The staging directory is renamed to its snapshot name, then the current
+    symlink is replaced by renaming a new symlink over it, so clients see
+    either the old or the new tree and never a mix.
+
+    :param str destination: repo destination
+    :param float now: unix timestamp naming the snapshot, default is the current time
+    :rtype: str
+    :returns: str absolute path of the new snapshot
+    :raises OSError: if the snapshot can't be published
+    """
+    if now is None:
+        now = time.time()
+    name = datetime.fromtimestamp(now).strftime(SNAPSHOT_FORMAT)
+    snapshot = os.path.join(snapshot_dir(destination), name)
+    if os.path.exists(snapshot):
+        raise OSError("Snapshot {0} already exists".format(snapshot))
+    os.rename(staging_path(destination), snapshot)
+
+    current = current_path(destination)
+    link = current + ".new"
+    if os.path.lexists(link):
+        os.unlink(link)
+    os.symlink(os.path.join("snapshots", name), link)
+    os.rename(link, current)
+    logging.info("Published {0}".format(snapshot))
+    return os.path.realpath(snapshot)
+
+
+def expired(destination, keep):
+    """Snapshots beyond the newest keep, never including the current one.
+
+    :param str destination: repo destination
+    :param int keep: Number of snapshots to keep
+    :rtype: list
+    :returns: list of absolute snapshot paths to delete, oldest first
+    """
+    current = current_snapshot(destination)
+    return [path for path in snapshots(destination)[:-keep] if path != current]
@@ -0,0 +1,109 @@
+import sqlite3
+import threading
+
+
+class StateStore(object):
+    def __init__(self, path):
+        """Persistent history of syncs, kept in an sqlite database.
+
+        Safe to use from any thread, every call is serialized on one
+        connection.
+
+        :param str path: Location of the database file, created if missing
+        :raises sqlite3.Error: if the database can't be opened
+        """
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.row_factory = sqlite3.Row
+        with self.__lock:
+            self.__db.execute("""CREATE TABLE IF NOT EXISTS syncs (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                start REAL,
+                finish REAL,
+                exit_code INTEGER,
+                duration REAL,
+                bytes INTEGER,
+                outcome TEXT)""")
+            self.__db.execute("CREATE INDEX IF NOT EXISTS syncs_name ON syncs (name, finish)")
+            self.__db.execute("""CREATE TABLE IF NOT EXISTS probes (
+                name TEXT PRIMARY KEY,
+                value TEXT)""")
+            self.__db.commit()
+
+    def record(self, name, start, finish, exit_code, bytes, outcome):
+        """Record a finished sync.
+
+        :param str name: Name of repo
+        :param float start: unix timestamp the sync started
+        :param float finish: unix timestamp the sync finished
+        :param int exit_code: rsync exit code, None if rsync never ran
+        :param int bytes: bytes transferred, None if unknown
+        :param str outcome: result of the sync (ex. success or failed)
+        """
+        duration = finish - start if start is not None else None
+        with self.__lock:
+            self.__db.execute("INSERT INTO syncs (name, start, finish, exit_code, duration, bytes, outcome) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (name, start, finish, exit_code, duration, bytes, outcome))
+            self.__db.commit()
+
+    def history(self, name, limit=10, outcomes=None):
+        """Most recent syncs of a repo, newest first.
+
+        :param str name: Name of repo
+        :param int limit: Max number of syncs returned
+        :param tuple outcomes: only syncs with one of these outcomes, None for all
+        :rtype: list
+        :returns: list of dicts with the recorded columns
+        """
+        query, args = "SELECT * FROM syncs WHERE name = ?", [name]
+        if outcomes is not None:
+            query += " AND outcome IN ({0})".format(", ".join("?" * len(outcomes)))
+            args.extend(outcomes)
+        with self.__lock:
+            rows = self.__db.execute(query + " ORDER BY finish DESC LIMIT ?", args + [limit]).fetchall()
+        return [dict(row) for row in rows]
+
+    def last(self, name, outcomes=None):
+        """Most recent sync of a repo.
+
+        :param str name: Name of repo
+        :param tuple outcomes: only syncs with one of these outcomes, None for all
+        :rtype: dict
+        :returns: dict with the recorded columns
+        :rtype: None
+        :returns: None if the repo has never synced
+        """
+        rows = self.history(name, 1, outcomes)
+        if rows:
+            return rows[0]
+
+    def probe(self, name):
+        """Probe value of the last successful sync of a repo.
+
+        :param str name: Name of repo
+        :rtype: str
+        :returns: str value recorded by set_probe
+        :rtype: None
+        :returns: None if none was recorded
+        """
+        with self.__lock:
+            row = self.__db.execute("SELECT value FROM probes WHERE name = ?", (name,)).fetchone()
+        if row:
+            return row["value"]
+
+    def set_probe(self, name, value):
+        """Record the probe value of a successful sync.
+
+        :param str name: Name of repo
+        :param str value: digest of the upstream probe file
+        """
+        with self.__lock:
+            self.__db.execute("INSERT OR REPLACE INTO probes (name, value) VALUES (?, ?)", (name, value))
+            self.__db.commit()
+
+    def close(self):
+        """Close the database."""
+        with self.__lock:
+            self.__db.close()
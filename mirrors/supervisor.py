@@ -0,0 +1,82 @@
+import logging
+import os
+import select
+import threading
+
+
+class Supervisor(threading.Thread):
+    def __init__(self, interval=0.1):
+        """Single thread which drives the processes of every running sync.
+
+        Jobs provide a steps() generator that yields each process it starts.
+        Every yielded process is polled from this thread and the job is resumed
+        once it exits, so no thread sits blocked on a process. Output of
+        processes started with a stdout pipe is read with select and handed to
+        the job's read_output().
+
+        :param float interval: seconds between polls of running processes
+        """
+        threading.Thread.__init__(self, name="supervisor")
+        self.daemon = True
+        self.interval = interval
+
+        # jobs waiting for their first step
+        self.__pending = []
+        # steps generator -> (job, process being waited on)
+        self.__running = dict()
+        self.__cond = threading.Condition()
+
+    def add(self, job):
+        """Start driving a job.
+
+        :param job: object with a steps() generator, ex. Repo.rsync_job
+        """
+        with self.__cond:
+            self.__pending.append(job)
+            self.__cond.notify()
+
+    def __len__(self):
+        with self.__cond:
+            return len(self.__pending) + len(self.__running)
+
+    def __advance(self, job, steps):
+        """Resume a job until it yields its next process or finishes."""
+        try:
+            proc = next(steps)
+        except StopIteration:
+            self.__running.pop(steps, None)
+        except Exception:
+            self.__running.pop(steps, None)
+            logging.exception("Sync of {0} failed".format(job.name))
+        else:
+            self.__running[steps] = (job, proc)
+
+    def run(self):
+        while(True):
+            with self.__cond:
+                while not self.__pending and not self.__running:
+                    self.__cond.wait()
+                pending, self.__pending = self.__pending, []
+
+            for job in pending:
+                self.__advance(job, job.steps())
+
+            for steps, (job, proc) in self.__running.items():
+                # a piped process is done once its output is drained
+                if proc.poll() is not None and (not proc.stdout or proc.stdout.closed):
+                    self.__advance(job, steps)
+
+            pipes = dict((proc.stdout.fileno(), (job, proc)) for job, proc in self.__running.values()
+                         if proc.stdout and not proc.stdout.closed)
+            if pipes:
+                for fd in select.select(pipes.keys(), [], [], self.interval)[0]:
+                    job, proc = pipes[fd]
+                    data = os.read(fd, 65536)
+                    if data:
+                        job.read_output(data)
+                    else:
+                        proc.stdout.close()
+            else:
+                with self.__cond:
+                    if not self.__pending:
+                        self.__cond.wait(self.interval)
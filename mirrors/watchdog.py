@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+from mirrors.libmirrors import t2s
+
+
+class Watchdog(threading.Thread):
+    def __init__(self, repo_manager, interval=5):
+        """Thread which stops syncs that run too long or stall.
+
+        A sync is stopped once it has run longer than its max_runtime, or has
+        shown no activity for its stall_timeout. It is sent SIGTERM, then
+        SIGKILL if it is still alive kill_grace later, and is retried like
+        any transient failure once it exits. Syncs terminated by hand are escalated the same way.
+
+        :param repo_manager: Manager whose repos are watched
+        :type repo_manager: RepoManager
+        :param float interval: seconds between checks
+        """
+        threading.Thread.__init__(self, name="watchdog")
+        self.daemon = True
+        self.repo_manager = repo_manager
+        self.interval = interval
+
+    def check(self, repo):
+        """Check a single repo, signaling its sync if needed.
+
+        :param repo: Repo to check
+        :type repo: Repo
+        """
+        if not repo.is_alive():
+            return
+
+        now = time.time()
+        terminated = repo.terminated_at()
+        if terminated:
+            if now - terminated >= t2s(repo.config.get("GLOBAL", "kill_grace")):
+                logging.warning("{0} still running after SIGTERM, killing".format(repo.name))
+                repo.kill()
+            return
+
+        # hooks run outside the sync slots and aren't held to max_runtime or stall_timeout
+        if repo.in_hooks():
+            return
+
+        max_runtime = t2s(repo.config.get(repo.name, "max_runtime"))
+        stall_timeout = t2s(repo.config.get(repo.name, "stall_timeout"))
+        running = repo.running_time()
+
+        if max_runtime and running and running.total_seconds() > max_runtime:
+            logging.warning("{0} exceeded max_runtime of {1}, terminating".format(repo.name, repo.config.get(repo.name, "max_runtime")))
+        elif stall_timeout and now - (repo.last_activity() or now) > stall_timeout:
+            logging.warning("{0} stalled for over {1}, terminating".format(repo.name, repo.config.get(repo.name, "stall_timeout")))
+        else:
+            return
+
+        repo.terminate(requeue=True)
+
+    def run(self):
+        while(True):
+            time.sleep(self.interval)
+            for repo in list(self.repo_manager.gen_repo()):
+                try:
+                    self.check(repo)
+                except Exception:
+                    logging.exception("Watchdog check of {0} failed".format(repo.name))
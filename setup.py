@@ -20,4 +20,6 @@ setup(name='mirrors',
       entry_points="""
       [console_scripts]
       mirrors=mirrors:main
+      mirrorsctl=mirrors.control:main
+      mirrors-manifest=mirrors.manifest:main
       """)